@@ -72,6 +72,9 @@ LOG_LLM_TIMING = _env_bool("SIM_LOG_LLM_TIMING", False)
 # 是否打印 create_fast_llm 的 model/reasoning_effort/base_url，OPENAI_LLM_DEBUG=1 开启
 LLM_DEBUG = _env_bool("OPENAI_LLM_DEBUG", False)
 
+# 使用自定义 base_url 时，首次规划在后台探测一次端点 TCP 连通性（不阻塞调用），规划失败时打印结果；OPENAI_PREFLIGHT=0 关闭
+LLM_PREFLIGHT = _env_bool("OPENAI_PREFLIGHT", True)
+
 # 单次 LLM HTTP 请求超时（秒），超时后抛错并触发重试，不无限等待；OPENAI_REQUEST_TIMEOUT 覆盖，默认 120
 LLM_REQUEST_TIMEOUT = max(30, _env_int("OPENAI_REQUEST_TIMEOUT", 120))
 
@@ -87,14 +90,30 @@ INNER_LLM_RETRY_DELAY = max(1, _env_int("SIM_INNER_LLM_RETRY_DELAY", 2))
 # --- Planning ---
 PLANNING_TEMPERATURE = _env_float("SIM_PLANNING_TEMPERATURE", 0.7)
 PLANNING_USE_RESPONSES_API = False
+# 规划审核/修正（规则核对与按反馈改写）用的模型与温度：生成保留采样多样性，审核/修正要确定性，默认温度 0；
+# SIM_PLANNING_CRITIC_MODEL 为空时沿用 DEFAULT_MODEL，设置后按原名调用、不受 OPENAI_MODEL 覆盖；SIM_PLANNING_CRITIC_TEMPERATURE 覆盖温度
+PLANNING_CRITIC_MODEL = _env("SIM_PLANNING_CRITIC_MODEL", "") or DEFAULT_MODEL
+PLANNING_CRITIC_TEMPERATURE = _env_float("SIM_PLANNING_CRITIC_TEMPERATURE", 0.0)
+# 规划层 LLM 的采样种子（OpenAI seed 参数，尽力复现，便于结果缓存命中），空则不传；SIM_PLANNING_SEED 覆盖
+_planning_seed = _env("SIM_PLANNING_SEED", "")
+PLANNING_SEED = int(_planning_seed) if _planning_seed.lstrip("-").isdigit() else None
 
 # --- Event ---
 EVENT_TEMPERATURE = _env_float("SIM_EVENT_TEMPERATURE", 0.7)
 EVENT_USE_RESPONSES_API = False
+# 事件生成/校验/修正的精确匹配缓存（data/event_llm_cache.sqlite）：输入逐字节相同则复用上次结果，适合温度 0 或复现式重跑；默认关闭以保留采样多样性，SIM_EVENT_LLM_CACHE=1 开启
+EVENT_LLM_CACHE = _env_bool("SIM_EVENT_LLM_CACHE", False)
 
 # --- Device Operate ---
 DEVICE_OPERATE_TEMPERATURE = _env_float("SIM_DEVICE_OPERATE_TEMPERATURE", 0.3)
 DEVICE_OPERATE_USE_RESPONSES_API = False
+# 单次 LLM 调用合并分析的事件数（摊薄提示词与网络往返开销），SIM_DEVICE_BATCH_SIZE 覆盖，1 则逐事件调用
+DEVICE_OPERATE_BATCH_SIZE = max(1, _env_int("SIM_DEVICE_BATCH_SIZE", 8))
+# 按 (模型, 温度, 提示词, 事件块) 的 SHA-256 精确缓存 LLM 结果到 data/device_llm_cache.sqlite，重跑相同输入不再请求；
+# 与 Event/Planning 缓存一致，默认关闭以保留采样多样性，适合温度 0 或复现式重跑，SIM_DEVICE_LLM_CACHE=1 开启
+DEVICE_OPERATE_LLM_CACHE = _env_bool("SIM_DEVICE_LLM_CACHE", False)
+# 简单批次（每个事件目标设备 ≤ 2 个）改走的更快模型，失败时回退 DEFAULT_MODEL 重试；空则不分流。SIM_DEVICE_FAST_MODEL 覆盖，按原名调用、不受 OPENAI_MODEL 覆盖
+DEVICE_OPERATE_FAST_MODEL = _env("SIM_DEVICE_FAST_MODEL", "")
 
 # --- Settings 脚本 ---
 SETTINGS_DEFAULT_TEMPERATURE = _env_float("SIM_SETTINGS_TEMPERATURE", 0.0)
@@ -132,9 +151,12 @@ RANDOM_SEED = _env("SIM_RANDOM_SEED", "").strip() or None
 # 首日强制状态，如 "Normal" / "Perturbed" / "Crisis"；SIM_FORCE_DAY1_STATE 覆盖
 FORCE_DAY1_STATE = _env("SIM_FORCE_DAY1_STATE", "").strip() or None
 
-# 写 JSON 是否紧凑（无 indent）以省 I/O，SIM_COMPACT_JSON=1 开启
+# 写 JSON 是否紧凑（无 indent）以省 I/O，作用于 data/ 下所有输出文件（activity/events/action_event_chain/evaluation_report 及按日归档），SIM_COMPACT_JSON=1 开启
 COMPACT_JSON = _env_bool("SIM_COMPACT_JSON", False)
 
+# 嵌入 Planning/Event 提示词的 JSON（居民档案、房屋布局、仿真上下文、房间物品清单、agent_state）是否缩进；模型不需要空白，默认紧凑以省输入 token，本地排查提示词时 SIM_PROMPT_JSON_INDENT=1 开启
+PROMPT_JSON_INDENT = _env_bool("SIM_PROMPT_JSON_INDENT", False)
+
 # =============================================================================
 # 室外天气（OpenWeather）
 # =============================================================================
@@ -152,6 +174,22 @@ SKIP_PLANNING_VALIDATION = _env_bool("SIM_SKIP_PLANNING_VALIDATION", False)
 # 校验未过时最多修正几轮，SIM_MAX_PLANNING_REVISIONS 覆盖
 MAX_PLANNING_REVISIONS = max(0, _env_int("SIM_MAX_PLANNING_REVISIONS", 3))
 
+# 规划修正是否只重写校验反馈点名的活动（含前后相邻各 1 个）并本地合并，减少修正轮的输入/输出 token；
+# 反馈未点名具体 activity_id 时仍整份修正。默认关闭，SIM_PLANNING_DELTA_CORRECTION=1 开启
+PLANNING_DELTA_CORRECTION = _env_bool("SIM_PLANNING_DELTA_CORRECTION", False)
+
+# 规划层结构化输出额外通过 extra_body.guided_json 下发 JSON Schema，供忽略 response_format 的 vLLM 等本地后端做约束解码；
+# OpenAI 官方端点已由 json_schema + strict 约束，无需开启。SIM_PLANNING_GUIDED_JSON=1 开启
+PLANNING_GUIDED_JSON = _env_bool("SIM_PLANNING_GUIDED_JSON", False)
+
+# 按 (模型, 温度, 提示词, 档案/布局/仿真上下文) 精确缓存通过校验的最终规划到 data/planning_plan_cache.sqlite，
+# 相同输入重跑时跳过整个 generate/validate/correct 流程；默认关闭以保留采样多样性，SIM_PLANNING_PLAN_CACHE=1 开启
+PLANNING_PLAN_CACHE = _env_bool("SIM_PLANNING_PLAN_CACHE", False)
+
+# 生成节点在同一次调用里输出规划与自检结论，自检通过（且本地硬校验通过）时跳过独立的 LLM 审核，正常路径省一次往返；
+# 自检不如独立审核严格，默认关闭，SIM_PLANNING_SELF_CHECK=1 开启
+PLANNING_SELF_CHECK = _env_bool("SIM_PLANNING_SELF_CHECK", False)
+
 # =============================================================================
 # Event 层：校验与修正轮数
 # =============================================================================
@@ -159,6 +197,10 @@ MAX_PLANNING_REVISIONS = max(0, _env_int("SIM_MAX_PLANNING_REVISIONS", 3))
 # 是否跳过 event 校验/修正（默认不跳过），SIM_SKIP_EVENT_VALIDATION=1 开启
 SKIP_EVENT_VALIDATION = _env_bool("SIM_SKIP_EVENT_VALIDATION", False)
 
+# 是否用本地确定性规则代替 LLM 审核（房间/物品归属/时间连续与覆盖/换房间需 move），省去每轮一次校验调用；
+# 性格一致性、中文描述、意图与设备功能对照等语义维度仅 LLM 审核覆盖，默认关闭，SIM_EVENT_LOCAL_VALIDATION=1 开启
+EVENT_LOCAL_VALIDATION = _env_bool("SIM_EVENT_LOCAL_VALIDATION", False)
+
 # 是否按段生成事件并每段后调用物理引擎推进环境（默认开启），使环境变化与设备操作形成因果链
 USE_ITERATIVE_EVENT_GENERATION = _env_bool("USE_ITERATIVE_EVENT_GENERATION", True)
 
@@ -1,6 +1,7 @@
 import os
 import json
 import sys
+import hashlib
 import logging
 import threading
 from concurrent.futures import ThreadPoolExecutor
@@ -12,17 +13,28 @@ project_root = Path(__file__).resolve().parent.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 from llm_utils import create_fast_llm
+from llm_cache import ResultCache, cache_key
+from json_utils import load_json_file
 from prompt import DEVICE_STATE_GEN_PROMPT
 from agent_config import (
     DEFAULT_MODEL,
     DEVICE_OPERATE_TEMPERATURE,
     DEVICE_OPERATE_USE_RESPONSES_API,
+    DEVICE_OPERATE_BATCH_SIZE,
+    DEVICE_OPERATE_LLM_CACHE,
+    DEVICE_OPERATE_FAST_MODEL,
+    COMPACT_JSON,
     MAX_WORKERS_DEFAULT,
 )
 
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # Load environment variables
 current_dir = Path(__file__).resolve().parent
 dotenv_path = current_dir.parent / '.env'
@@ -49,6 +61,12 @@ class EventDeviceState(BaseModel):
     patch_on_start: List[DevicePatch] = Field(description="Device changes at event start")
     patch_on_end: List[DevicePatch] = Field(description="Device changes at event end")
 
+class IndexedEventDeviceState(EventDeviceState):
+    event_index: int = Field(description="Index of the event in the input list, copied from its [event_index] label")
+
+class BatchEventDeviceState(BaseModel):
+    results: List[IndexedEventDeviceState] = Field(description="One device state result per input event")
+
 # ==========================================
 # 2. Core prompt
 # ==========================================
@@ -58,8 +76,6 @@ class EventDeviceState(BaseModel):
 # 3. Helpers
 # ==========================================
 
-_thread_local = threading.local()
-
 def _estimate_prompt_chars(template: str, variables: Dict[str, Any]) -> int:
     total = len(template or "")
     for val in variables.values():
@@ -80,85 +96,182 @@ def get_max_workers(total: int, env_name: str = "MAX_WORKERS", default: int = No
                 return min(value, total)
         except ValueError:
             pass
-    cpu_count = os.cpu_count() or default
-    return min(total, max(1, min(8, cpu_count)))
+    # 工作线程只等待 LLM 网络响应，不占 CPU：并行度取配置默认值，不按 CPU 核数截断
+    return min(total, max(1, default))
+
+_structured_llms: Dict[str, Any] = {}
+# 配置名 -> 实际调用的模型名（create_fast_llm 解析 OPENAI_MODEL 之后），缓存键按后者记录
+_resolved_model_names: Dict[str, str] = {}
+_structured_llm_lock = threading.Lock()
 
-def get_thread_structured_llm():
-    structured_llm = getattr(_thread_local, "structured_llm", None)
+def get_structured_llm(model: str = DEFAULT_MODEL):
+    """
+    Runnable 构建后即线程安全：每个模型只建一个实例，所有工作线程共用（连接池由 create_fast_llm 统一共享）。
+    快速模型是单独配置的，按原名调用，不被 OPENAI_MODEL 覆盖。
+    """
+    structured_llm = _structured_llms.get(model)
     if structured_llm is None:
-        # 极速 LLM，use_responses_api=False 以兼容 with_structured_output
-        llm = create_fast_llm(
-            model=DEFAULT_MODEL,
-            temperature=DEVICE_OPERATE_TEMPERATURE,
-            use_responses_api=DEVICE_OPERATE_USE_RESPONSES_API,
-        )
-        structured_llm = llm.with_structured_output(EventDeviceState, method="json_schema", strict=True)
-        _thread_local.structured_llm = structured_llm
+        with _structured_llm_lock:
+            structured_llm = _structured_llms.get(model)
+            if structured_llm is None:
+                # 极速 LLM，use_responses_api=False 以兼容 with_structured_output
+                llm = create_fast_llm(
+                    model=model,
+                    temperature=DEVICE_OPERATE_TEMPERATURE,
+                    use_responses_api=DEVICE_OPERATE_USE_RESPONSES_API,
+                    pin_model=bool(DEVICE_OPERATE_FAST_MODEL) and model == DEVICE_OPERATE_FAST_MODEL,
+                )
+                structured_llm = llm.with_structured_output(BatchEventDeviceState, method="json_schema", strict=True)
+                _resolved_model_names[model] = llm.model_name
+                _structured_llms[model] = structured_llm
     return structured_llm
 
+def _route_model(batch: List[tuple]) -> str:
+    """每个事件目标设备都不超过 2 个的批次视为简单批次，配置了快速模型时交给它。"""
+    if DEVICE_OPERATE_FAST_MODEL and all(len(target_ids) <= 2 for _, _, target_ids in batch):
+        return DEVICE_OPERATE_FAST_MODEL
+    return DEFAULT_MODEL
+
+# 静态说明在前、事件块在末尾：各批次请求共享同一前缀，可命中服务端的前缀缓存
+_DEVICE_STATE_PROMPT = ChatPromptTemplate.from_template(DEVICE_STATE_GEN_PROMPT)
+# 静态前缀的指纹，运行开始时打印，便于核对跨批次/跨运行前缀逐字节不变
+_DEVICE_PROMPT_PREFIX_HASH = hashlib.sha256(
+    DEVICE_STATE_GEN_PROMPT.split("{events_block}", 1)[0].encode("utf-8")
+).hexdigest()[:12]
+
+_llm_cache = ResultCache(project_root / "data" / "device_llm_cache.sqlite", "device_llm_cache")
+
+def _invoke_cached(chain, payload: Dict[str, Any], model: str = DEFAULT_MODEL) -> BatchEventDeviceState:
+    """精确匹配缓存：相同模型/温度/提示词/事件块直接复用上次的结构化结果，跳过网络往返。"""
+    if not DEVICE_OPERATE_LLM_CACHE:
+        return chain.invoke(payload)
+    key = cache_key(_resolved_model_names.get(model, model), DEVICE_OPERATE_TEMPERATURE, DEVICE_STATE_GEN_PROMPT, payload)
+    cached = _llm_cache.get(key, BatchEventDeviceState)
+    if cached is not None:
+        return cached
+    result = chain.invoke(payload)
+    _llm_cache.put(key, result)
+    return result
+
 def load_settings_data(project_root: Path) -> Dict[str, Any]:
     """"""
     settings_path = project_root / "settings"
     data = {"house_details_map": {}}
 
     if (settings_path / "house_details.json").exists():
-        with open(settings_path / "house_details.json", 'r', encoding='utf-8') as f:
-            details_list = json.load(f)
-            for item in details_list:
-                item_id = item.get("furniture_id") or item.get("device_id")
-                if item_id:
-                    data["house_details_map"][item_id] = item
+        details_list = load_json_file(settings_path / "house_details.json")
+        for item in details_list:
+            item_id = item.get("furniture_id") or item.get("device_id")
+            if item_id:
+                data["house_details_map"][item_id] = item
+    data["device_context_map"] = build_device_context_map(data["house_details_map"])
     return data
 
-def get_device_context(target_ids: List[str], details_map: Dict) -> str:
-    """?"""
-    context = []
-    for tid in target_ids:
-        if tid in details_map:
-            info = details_map[tid]
-            context.append(f"{tid} ({info.get('name', 'Unknown')}) - Supports: {info.get('support_actions', [])}")
-    return "; ".join(context)
-
-def _normalize_patch_items(patch_items: List[PatchItem]) -> List[PatchItem]:
-    allowed = {
-        "power",
-        "mode",
-        "temperature",
-        "brightness",
-        "volume",
-        "color",
-        "fan_speed",
-        "timer",
+def build_device_context_map(details_map: Dict) -> Dict[str, str]:
+    """details_map 在一次运行内不变：预先为每个物品拼好上下文行，事件处理时只做查表。"""
+    return {
+        tid: f"{tid} ({info.get('name', 'Unknown')}) - Supports: {info.get('support_actions', [])}"
+        for tid, info in details_map.items()
     }
-    normalized: List[PatchItem] = []
+
+def get_device_context(target_ids: List[str], context_map: Dict[str, str]) -> str:
+    """按 target_ids 顺序从预计算的 context_map 拼接设备上下文，未知 ID 跳过。"""
+    return "; ".join(context_map[tid] for tid in target_ids if tid in context_map)
+
+def _iter_events_file(events_file: Path):
+    """
+    逐条产出事件文件中的事件。文件可为 {"events": [...], "meta": ...} 或顶层事件列表。
+    装有 ijson 时流式解析，只物化事件本身（meta 中的环境快照不会被载入）；否则整体解析。
+    """
+    if ijson is None:
+        raw = load_json_file(events_file)
+        yield from (raw.get("events", raw) if isinstance(raw, dict) else raw)
+        return
+    with open(events_file, 'rb') as f:
+        first = f.read(64).lstrip()[:1]
+        f.seek(0)
+        prefix = "item" if first == b"[" else "events.item"
+        yield from ijson.items(f, prefix, use_float=True)
+
+def _format_events_block(
+    batch: List[tuple],
+    context_map: Dict[str, str],
+    context_cache: Optional[Dict[tuple, str]] = None,
+) -> str:
+    """
+    将一批 (index, event, target_ids) 格式化为带 [index] 编号的事件清单，供批量提示词使用。
+    context_cache 按 target_ids 元组缓存设备上下文：一天里同一组设备反复出现，拼接结果可复用。
+    """
+    blocks = []
+    for index, event, target_ids in batch:
+        if context_cache is None:
+            reference = get_device_context(target_ids, context_map)
+        else:
+            key = tuple(target_ids)
+            reference = context_cache.get(key)
+            if reference is None:
+                reference = context_cache[key] = get_device_context(target_ids, context_map)
+        blocks.append(
+            f"[{index}]\n"
+            f"- **Event**: {event.get('description')}\n"
+            f"- **Time**: {event.get('start_time')} to {event.get('end_time')}\n"
+            f"- **Devices**: {', '.join(target_ids)}\n"
+            f"- **Reference**: {reference}"
+        )
+    return "\n\n".join(blocks)
+
+_ALLOWED_PATCH_KEYS = frozenset({
+    "power",
+    "mode",
+    "temperature",
+    "brightness",
+    "volume",
+    "color",
+    "fan_speed",
+    "timer",
+})
+# 开/关门类 key 直接映射为 state 的取值
+_DOOR_KEY_STATE = {
+    "open": "open",
+    "open_door": "open",
+    "door": "open",
+    "close": "closed",
+    "close_door": "closed",
+}
+# key == "state" 时取值的归一化（已小写）；不在表中的取值丢弃
+_STATE_VALUE_REMAP = {
+    "open": "open",
+    "opened": "open",
+    "true": "open",
+    "on": "open",
+    "close": "closed",
+    "closed": "closed",
+    "false": "closed",
+    "off": "closed",
+}
+
+def _iter_normalized_patch_items(patch_items: List[PatchItem]):
+    """规范化 patch 项，直接产出 (key, value)，不再为每项新建 PatchItem。"""
     for item in patch_items:
         key = (item.key or "").strip().lower()
-        value = str(item.value).strip()
-        if key in {"open", "open_door", "door"}:
-            normalized.append(PatchItem(key="state", value="open"))
-            continue
-        if key in {"close", "close_door"}:
-            normalized.append(PatchItem(key="state", value="closed"))
+        door_state = _DOOR_KEY_STATE.get(key)
+        if door_state is not None:
+            yield "state", door_state
             continue
+        value = str(item.value).strip()
         if key == "state":
-            if value.lower() in {"open", "opened", "true", "on"}:
-                normalized.append(PatchItem(key="state", value="open"))
-                continue
-            if value.lower() in {"close", "closed", "false", "off"}:
-                normalized.append(PatchItem(key="state", value="closed"))
-                continue
-        if key in allowed:
-            normalized.append(PatchItem(key=key, value=value))
-    return normalized
+            state = _STATE_VALUE_REMAP.get(value.lower())
+            if state is not None:
+                yield "state", state
+        elif key in _ALLOWED_PATCH_KEYS:
+            yield key, value
 
 def convert_patch_to_dict(patch_obj: DevicePatch) -> Dict:
     """将 PatchItem 转为 Dict 以便写入 JSON。"""
-    normalized = _normalize_patch_items(patch_obj.patch_items)
-    kv_dict = {item.key: item.value for item in normalized}
     return {
         "timestamp": patch_obj.timestamp,
         "device_id": patch_obj.device_id,
-        "patch": kv_dict
+        "patch": dict(_iter_normalized_patch_items(patch_obj.patch_items)),
     }
 
 
@@ -218,6 +331,9 @@ def run_event_chain_generation(cached_settings: Optional[Dict[str, Any]] = None)
         settings = cached_settings
     else:
         settings = load_settings_data(project_root)
+    device_context_map = settings.get("device_context_map")
+    if device_context_map is None:
+        device_context_map = build_device_context_map(settings["house_details_map"])
     events_file = project_root / "data" / "final_events_full_day.json"
     
     if not events_file.exists():
@@ -227,16 +343,14 @@ def run_event_chain_generation(cached_settings: Optional[Dict[str, Any]] = None)
         logger.error("No events file found. Please run Layer 3 first.")
         return
 
-    with open(events_file, 'r', encoding='utf-8') as f:
-        raw = json.load(f)
-    events_list = raw.get("events", raw) if isinstance(raw, dict) else raw
-
-    logger.info(f"Generating Action Event Chain for {len(events_list)} events...")
+    logger.info(f"Generating Action Event Chain from {events_file.name}...")
+    logger.info("Device prompt prefix sha256: %s", _DEVICE_PROMPT_PREFIX_HASH)
 
     final_chain = []
     tasks = []
+    context_cache: Dict[tuple, str] = {}
 
-    for index, event in enumerate(events_list):
+    for index, event in enumerate(_iter_events_file(events_file)):
         target_ids = event.get("target_object_ids", [])
         is_outside = event.get("room_id") == "Outside"
         use_devices = len(target_ids) > 0 and not is_outside
@@ -273,68 +387,114 @@ def run_event_chain_generation(cached_settings: Optional[Dict[str, Any]] = None)
         final_chain.append(event_output)
 
         if use_devices and (not device_patches or len(device_patches) == 0):
-            desc_short = event.get('description', '')[:20]
-            logger.info(f"Analyzing devices for event [{index+1}]: {desc_short}...")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Analyzing devices for event [%d]: %s...", index + 1, event.get('description', '')[:20])
             tasks.append((index, event, target_ids))
 
-    def _worker(task):
-        index, event, target_ids = task
-        device_context = get_device_context(target_ids, settings["house_details_map"])
-        prompt = ChatPromptTemplate.from_template(DEVICE_STATE_GEN_PROMPT)
-        chain = prompt | get_thread_structured_llm()
-        try:
-            payload = {
-                "description": event.get("description"),
-                "start_time": event.get("start_time"),
-                "end_time": event.get("end_time"),
-                "target_devices": ", ".join(target_ids),
-                "device_details": device_context
-            }
+    logger.info("Loaded %d events, %d need LLM device analysis.", len(final_chain), len(tasks))
+
+    chains = {}
+    if tasks:
+        for model in {DEFAULT_MODEL, DEVICE_OPERATE_FAST_MODEL} - {""}:
+            chains[model] = _DEVICE_STATE_PROMPT | get_structured_llm(model)
+    route_counts = {"fast": 0, "default": 0, "fallback": 0}
+    route_lock = threading.Lock()
+
+    def _invoke(batch, payload):
+        model = _route_model(batch)
+        if model != DEFAULT_MODEL:
             try:
-                chars = _estimate_prompt_chars(DEVICE_STATE_GEN_PROMPT, payload)
-                logger.info(f"LLM input size (device): ~{chars} chars (~{chars//4} tokens)")
-            except Exception:
-                pass
-            result = chain.invoke(payload)
-            
-            start_patches = [convert_patch_to_dict(p) for p in result.patch_on_start]
-            end_patches = [convert_patch_to_dict(p) for p in result.patch_on_end]
-            return index, start_patches, end_patches, None
+                result = _invoke_cached(chains[model], payload, model)
+                with route_lock:
+                    route_counts["fast"] += 1
+                return result
+            except Exception as e:
+                # 快速模型报错或输出不符合 schema：回退默认模型重试
+                logger.warning("Fast model %s failed on events %s, retrying with %s: %s", model, [t[0] for t in batch], DEFAULT_MODEL, e)
+                route = "fallback"
+        else:
+            route = "default"
+        result = _invoke_cached(chains[DEFAULT_MODEL], payload, DEFAULT_MODEL)
+        with route_lock:
+            route_counts[route] += 1
+        return result
+
+    def _worker(batch):
+        try:
+            payload = {"events_block": _format_events_block(batch, device_context_map, context_cache)}
+            if logger.isEnabledFor(logging.INFO):
+                try:
+                    chars = _estimate_prompt_chars(DEVICE_STATE_GEN_PROMPT, payload)
+                    logger.info("LLM input size (device, %d events): ~%d chars (~%d tokens)", len(batch), chars, chars // 4)
+                except Exception:
+                    pass
+            result = _invoke(batch, payload)
+
+            by_index = {r.event_index: r for r in result.results}
+            # 批量调用偶有漏掉部分事件：只把漏掉的事件再请求一次，而不是整批作废
+            missing = [task for task in batch if task[0] not in by_index]
+            if missing and len(batch) > 1:
+                logger.info("Re-requesting %d events missing from batch result: %s", len(missing), [task[0] for task in missing])
+                try:
+                    retry = _invoke(missing, {"events_block": _format_events_block(missing, device_context_map, context_cache)})
+                    for r in retry.results:
+                        by_index.setdefault(r.event_index, r)
+                except Exception as e:
+                    # 补请求失败不影响本批已拿到的结果
+                    logger.warning("Retry for missing events failed: %s", e)
+            outputs = []
+            for index, _event, _target_ids in batch:
+                r = by_index.get(index)
+                if r is None:
+                    outputs.append((index, None, None))
+                    continue
+                start_patches = list(map(convert_patch_to_dict, r.patch_on_start))
+                end_patches = list(map(convert_patch_to_dict, r.patch_on_end))
+                outputs.append((index, start_patches, end_patches))
+            return batch, outputs, None
         except Exception as e:
-            return index, None, None, e
+            return batch, None, e
+
+    def _collect(batch, outputs, error):
+        if error:
+            logger.error("LLM error on events %s: %s", [index for index, _, _ in batch], error)
+            return
+        for index, start_patches, end_patches in outputs:
+            if start_patches is None or end_patches is None:
+                logger.warning("LLM returned no device state for event %s", index)
+                continue
+            start_patches, end_patches = _dedupe_layer5_patches(start_patches, end_patches)
+            final_chain[index]["layer5_device_state"] = {
+                "patch_on_start": start_patches,
+                "patch_on_end": end_patches
+            }
 
     if tasks:
-        max_workers = get_max_workers(len(tasks))
-        if max_workers > 1:
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                for index, start_patches, end_patches, error in executor.map(_worker, tasks):
-                    if error:
-                        logger.error(f"LLM error on event {index}: {error}")
-                        continue
-                    if start_patches is not None and end_patches is not None:
-                        start_patches, end_patches = _dedupe_layer5_patches(start_patches, end_patches)
-                        final_chain[index]["layer5_device_state"] = {
-                            "patch_on_start": start_patches,
-                            "patch_on_end": end_patches
-                        }
+        # 多个事件合并为一次 LLM 调用；批次之间仍按线程池并行
+        batches = [tasks[i:i + DEVICE_OPERATE_BATCH_SIZE] for i in range(0, len(tasks), DEVICE_OPERATE_BATCH_SIZE)]
+        if len(batches) == 1:
+            # 只有一批时直接在当前线程调用，不计算并发度也不创建线程池
+            _collect(*_worker(batches[0]))
         else:
-            for task in tasks:
-                index, start_patches, end_patches, error = _worker(task)
-                if error:
-                    logger.error(f"LLM error on event {index}: {error}")
-                    continue
-                if start_patches is not None and end_patches is not None:
-                    start_patches, end_patches = _dedupe_layer5_patches(start_patches, end_patches)
-                    final_chain[index]["layer5_device_state"] = {
-                        "patch_on_start": start_patches,
-                        "patch_on_end": end_patches
-                    }
+            max_workers = get_max_workers(len(batches))
+            if max_workers > 1:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for batch, outputs, error in executor.map(_worker, batches):
+                        _collect(batch, outputs, error)
+            else:
+                for batch in batches:
+                    _collect(*_worker(batch))
+        if DEVICE_OPERATE_FAST_MODEL:
+            logger.info(
+                "Device model routing: fast=%d default=%d fallback=%d",
+                route_counts["fast"], route_counts["default"], route_counts["fallback"],
+            )
 
     output_data = {"action_event_chain": final_chain}
     output_path = project_root / "data" / "action_event_chain.json"
 
     with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+        json.dump(output_data, f, indent=None if COMPACT_JSON else 2, ensure_ascii=False)
 
     logger.info(f"Generated {len(final_chain)} event chains.")
     logger.info(f"Result saved to: {output_path}")
@@ -1,5 +1,6 @@
 import json
 import os
+import re
 import sys
 from datetime import datetime, time
 from pathlib import Path
@@ -13,6 +14,9 @@ project_root = current_dir.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
+from agent_config import COMPACT_JSON
+from json_utils import load_json_file
+
 DATA_DIR = project_root / "data"
 SETTINGS_DIR = project_root / "settings"
 
@@ -21,8 +25,7 @@ def _read_json(path: Path) -> Optional[Dict]:
     if not path.exists():
         return None
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_json_file(path)
     except Exception:
         return None
 
@@ -34,6 +37,14 @@ def _parse_iso(dt_str: str) -> Optional[datetime]:
         return None
 
 
+def _clock_delta_seconds(a: time, b: time) -> float:
+    """两个钟点之间相差的秒数（绝对值），不构造 datetime。"""
+    return abs(
+        (a.hour - b.hour) * 3600 + (a.minute - b.minute) * 60 + (a.second - b.second)
+        + (a.microsecond - b.microsecond) / 1_000_000
+    )
+
+
 def _collect_day_indexes() -> List[int]:
     days = set()
     for path in DATA_DIR.glob("simulation_context_day*.json"):
@@ -66,6 +77,18 @@ def _load_details() -> Dict:
     return details
 
 
+# 关键词扫描：每类关键词编译为一个正则，每段文本只扫描一遍
+_MEAL_KEYWORDS = {
+    "breakfast": ("早餐",),
+    "lunch": ("午餐", "午饭"),
+    "dinner": ("晚餐", "晚饭"),
+}
+_MEAL_BY_KEYWORD = {k: meal for meal, kws in _MEAL_KEYWORDS.items() for k in kws}
+_MEAL_RE = re.compile("|".join(map(re.escape, _MEAL_BY_KEYWORD)))
+_NEEDS_ADJUST_RE = re.compile("熬夜|睡眠不足|晚起|感冒|头晕|危机")
+_ADJUST_RE = re.compile("休息|调整|取消|降低强度|改为")
+
+
 def _score_structure(activities: List[Dict], day_start: str, day_end: str) -> Tuple[int, List[str]]:
     issues = []
     if not activities:
@@ -82,9 +105,7 @@ def _score_structure(activities: List[Dict], day_start: str, day_end: str) -> Tu
     starts.sort(key=lambda x: x[0])
 
     score = 100
-    for i in range(1, len(starts)):
-        prev_end = starts[i - 1][1]
-        cur_start = starts[i][0]
+    for (_, prev_end), (cur_start, _) in zip(starts, starts[1:]):
         if cur_start < prev_end:
             score -= 10
             issues.append("overlap detected")
@@ -120,31 +141,27 @@ def _score_persona(activities: List[Dict], profile: Dict, day_type: str) -> Tupl
         "lunch": meal_habits.get("lunch_time", meal_habits.get("lunch", "12:30")),
         "dinner": meal_habits.get("dinner_time", meal_habits.get("dinner", "19:30")),
     }
-    meal_keywords = {
-        "breakfast": ["早餐"],
-        "lunch": ["午餐", "午饭"],
-        "dinner": ["晚餐", "晚饭"],
-    }
+    # 一遍扫描所有活动名，记录每类餐食第一次出现的活动
+    first_meal_act: Dict[str, Dict] = {}
+    for act in activities:
+        for k in _MEAL_RE.findall(act.get("activity_name", "")):
+            first_meal_act.setdefault(_MEAL_BY_KEYWORD[k], act)
+        if len(first_meal_act) == len(_MEAL_KEYWORDS):
+            break
     for meal, target in meal_targets.items():
-        target_t = _parse_iso(f"2000-01-01T{target}:00")
-        found = False
-        for act in activities:
-            name = act.get("activity_name", "")
-            if any(k in name for k in meal_keywords[meal]):
-                s = _parse_iso(act.get("start_time", ""))
-                if s and target_t:
-                    actual = s.time()
-                    delta = abs(
-                        (datetime.combine(datetime.min, actual) - datetime.combine(datetime.min, target_t.time())).total_seconds()
-                    )
-                    if delta > 3600:
-                        score -= 8
-                        issues.append(f"{meal} time deviates >1h")
-                found = True
-                break
-        if not found:
+        act = first_meal_act.get(meal)
+        if act is None:
             score -= 8
             issues.append(f"{meal} missing")
+            continue
+        target_t = _parse_iso(f"2000-01-01T{target}:00")
+        s = _parse_iso(act.get("start_time", ""))
+        if s and target_t:
+            actual = s.time()
+            delta = _clock_delta_seconds(actual, target_t.time())
+            if delta > 3600:
+                score -= 8
+                issues.append(f"{meal} time deviates >1h")
 
     # Sleep check (simple)
     wake_time_key = "weekday_wakeup" if day_type == "workday" else "weekend_wakeup"
@@ -159,9 +176,7 @@ def _score_persona(activities: List[Dict], profile: Dict, day_type: str) -> Tupl
             actual = s.time()
             target_t = _parse_iso(f"2000-01-01T{wake_time}:00")
             if target_t:
-                delta = abs(
-                    (datetime.combine(datetime.min, actual) - datetime.combine(datetime.min, target_t.time())).total_seconds()
-                )
+                delta = _clock_delta_seconds(actual, target_t.time())
                 if delta > 5400:
                     score -= 10
                     issues.append("wake time deviates >1.5h")
@@ -172,9 +187,7 @@ def _score_persona(activities: List[Dict], profile: Dict, day_type: str) -> Tupl
             actual = e.time()
             target_t = _parse_iso(f"2000-01-01T{sleep_time}:00")
             if target_t:
-                delta = abs(
-                    (datetime.combine(datetime.min, actual) - datetime.combine(datetime.min, target_t.time())).total_seconds()
-                )
+                delta = _clock_delta_seconds(actual, target_t.time())
                 if delta > 7200:
                     score -= 10
                     issues.append("sleep time deviates >2h")
@@ -253,14 +266,14 @@ def _score_cross_day(
     if summary == "N/A":
         return score, issues
 
-    needs_adjust = any(k in summary for k in ["熬夜", "睡眠不足", "晚起", "感冒", "头晕", "危机"])
+    needs_adjust = _NEEDS_ADJUST_RE.search(summary) is not None
     if not needs_adjust:
         return score, issues
 
     found_adjust = False
     for act in activities:
         text = f"{act.get('activity_name', '')} {act.get('description', '')}"
-        if any(k in text for k in ["休息", "调整", "取消", "降低强度", "改为"]):
+        if _ADJUST_RE.search(text):
             found_adjust = True
             break
 
@@ -335,7 +348,7 @@ def main() -> None:
     report = evaluate()
     output_path = DATA_DIR / "evaluation_report.json"
     with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(report, f, indent=2, ensure_ascii=False)
+        json.dump(report, f, indent=None if COMPACT_JSON else 2, ensure_ascii=False)
     print(f"[OK] Evaluation saved to {output_path}")
 
 
@@ -6,7 +6,7 @@ import sys
 import time
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from typing_extensions import TypedDict
 
 from langchain_core.prompts import ChatPromptTemplate
@@ -14,7 +14,6 @@ from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END
 from dotenv import load_dotenv
 
-load_dotenv()
 current_dir = Path(__file__).resolve().parent
 dotenv_path = current_dir.parent / '.env'
 load_dotenv(dotenv_path=dotenv_path)
@@ -22,12 +21,15 @@ project_root = current_dir.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 from llm_utils import create_fast_llm
+from llm_cache import ResultCache, cache_key
+from json_utils import json_dumps, load_json_file
 from prompt import (
     EVENT_REQUIREMENTS,
     EVENT_GENERATION_PROMPT_TEMPLATE,
     EVENT_VALIDATION_PROMPT_TEMPLATE,
     EVENT_CORRECTION_PROMPT_TEMPLATE,
     VALUES_INTERPRETATION_GUIDE,
+    prerender,
 )
 from agent_config import (
     EVENT_MODEL,
@@ -40,6 +42,10 @@ from agent_config import (
     INNER_LLM_RETRY_COUNT,
     INNER_LLM_RETRY_DELAY,
     USE_ITERATIVE_EVENT_GENERATION,
+    COMPACT_JSON,
+    EVENT_LLM_CACHE,
+    EVENT_LOCAL_VALIDATION,
+    PROMPT_JSON_INDENT,
 )
 from physics_engine import calculate_room_state
 
@@ -85,7 +91,7 @@ class EventSequence(BaseModel):
 
 class ValidationResult(BaseModel):
     is_valid: bool = Field(description="是否通过验证")
-    correction_content: Optional[str] = Field(description="错误详情与修改建议")
+    correction_content: Optional[str] = Field(description="错误详情与修改建议；通过则为 null")
 
 # ==========================================
 # 3. 数据加载与环境上下文工具
@@ -106,31 +112,46 @@ def load_settings_data(project_root: Path) -> Dict[str, Any]:
 
     # Profile
     if (settings_path / "profile.json").exists():
-        with open(settings_path / "profile.json", 'r', encoding='utf-8') as f:
-            data["profile_json"] = json.dumps(json.load(f), ensure_ascii=False, indent=2)
+        data["profile_json"] = json_dumps(load_json_file(settings_path / "profile.json"), indent=PROMPT_JSON_INDENT)
 
     # House Layout
     if (settings_path / "house_layout.json").exists():
-        with open(settings_path / "house_layout.json", 'r', encoding='utf-8') as f:
-            data["house_layout"] = json.load(f)
+        data["house_layout"] = load_json_file(settings_path / "house_layout.json")
 
     # House Details (List -> Dict)
     if (settings_path / "house_details.json").exists():
-        with open(settings_path / "house_details.json", 'r', encoding='utf-8') as f:
-            details_list = json.load(f)
-            for item in details_list:
-                item_id = item.get("furniture_id") or item.get("device_id")
-                if item_id:
-                    data["house_details_map"][item_id] = item
+        details_list = load_json_file(settings_path / "house_details.json")
+        for item in details_list:
+            item_id = item.get("furniture_id") or item.get("device_id")
+            if item_id:
+                data["house_details_map"][item_id] = item
     
     return data
 
+# (id(layout), id(details), 房间元组) -> (layout, details, 结果)；活动的 main_rooms 组合很少，命中后直接复用已序列化的字符串
+_ROOM_CONTEXT_CACHE: Dict[Tuple[int, int, Tuple[str, ...]], Tuple[Dict, Dict, Dict[str, Any]]] = {}
+
+
 def get_room_specific_context(full_layout: Dict, details_map: Dict, target_rooms: List[str]) -> Dict[str, Any]:
+    """按 (layout, details, target_rooms) 记忆化的 _build_room_specific_context；返回值只读，调用方不得修改。"""
+    rooms_key = tuple(target_rooms or ())
+    key = (id(full_layout), id(details_map), rooms_key)
+    cached = _ROOM_CONTEXT_CACHE.get(key)
+    if cached is not None and cached[0] is full_layout and cached[1] is details_map:
+        return cached[2]
+    result = _build_room_specific_context(full_layout, details_map, list(rooms_key))
+    if len(_ROOM_CONTEXT_CACHE) >= 64:
+        _ROOM_CONTEXT_CACHE.clear()
+    _ROOM_CONTEXT_CACHE[key] = (full_layout, details_map, result)
+    return result
+
+
+def _build_room_specific_context(full_layout: Dict, details_map: Dict, target_rooms: List[str]) -> Dict[str, Any]:
     """
     上下文裁剪：以 layout 为存在性来源，只展示相关房间的物品；details 仅作名称与 support_actions 的补充。
     存在性检查在 layout 层（target_object_ids 已在 _sanitize_events 中按 layout 校验）；调设备时用 details 的 support_actions/current_state。
     """
-    room_list = list(full_layout.keys())
+    room_list_json = _layout_index(full_layout)[1]
     filtered_details = {}
 
     rooms_to_scan = [r for r in target_rooms if r in full_layout]
@@ -160,8 +181,8 @@ def get_room_specific_context(full_layout: Dict, details_map: Dict, target_rooms
         filtered_details[room_key] = room_items
 
     return {
-        "room_list_json": json.dumps(room_list, ensure_ascii=False),
-        "furniture_details_json": json.dumps(filtered_details, ensure_ascii=False, indent=2)
+        "room_list_json": room_list_json,
+        "furniture_details_json": json_dumps(filtered_details, indent=PROMPT_JSON_INDENT)
     }
 
 # ==========================================
@@ -173,12 +194,15 @@ class EventState(TypedDict):
     full_layout: Dict
     details_map: Dict
     current_activity: Dict
+    current_activity_json: str  # current_activity 序列化结果，generate 中算一次，validate/correct 循环复用
     previous_events: List[Dict]
     agent_state_json: str
     room_context_data: Dict
     current_events: Optional[EventSequence]
     validation_result: Optional[ValidationResult]
     revision_count: int
+    correction_stalled: bool  # 修正输出与修正前逐字节相同：再校验只会得到同样结论，直接结束
+    validation_fatal: Optional[str]  # 父活动本身不可满足（房间全不在 layout / 时间窗非法）的原因，修正无济于事
     environment_snapshot: Dict  # room_id -> {temperature, humidity, hygiene, last_update_ts}
     outdoor_weather: Dict       # {temperature, humidity} 室外
     device_states: Dict        # device_id -> {power, mode, ...} 全屋设备当前状态，用于物理闭环
@@ -190,6 +214,29 @@ llm = create_fast_llm(
     use_responses_api=EVENT_USE_RESPONSES_API,
 )
 
+# 事件要求与价值观解读是 prompt.py 常量，预先写入；居民档案/agent_state 按日变化，仍作为变量传入
+_GENERATION_TEMPLATE = prerender(
+    EVENT_GENERATION_PROMPT_TEMPLATE,
+    event_requirements=EVENT_REQUIREMENTS,
+    values_interpretation_guide=VALUES_INTERPRETATION_GUIDE,
+)
+_VALIDATION_TEMPLATE = prerender(EVENT_VALIDATION_PROMPT_TEMPLATE, event_requirements=EVENT_REQUIREMENTS)
+_CORRECTION_TEMPLATE = prerender(EVENT_CORRECTION_PROMPT_TEMPLATE, event_requirements=EVENT_REQUIREMENTS)
+
+# 提示词模板解析与结构化输出管线在导入时构建一次，各节点调用时复用
+_GENERATE_CHAIN = ChatPromptTemplate.from_template(_GENERATION_TEMPLATE) | llm.with_structured_output(
+    EventSequence, method="json_schema", strict=True
+)
+_VALIDATE_CHAIN = ChatPromptTemplate.from_template(_VALIDATION_TEMPLATE) | llm.with_structured_output(
+    ValidationResult, method="json_schema", strict=True
+)
+_CORRECT_CHAIN = ChatPromptTemplate.from_template(_CORRECTION_TEMPLATE) | llm.with_structured_output(
+    EventSequence, method="json_schema", strict=True
+)
+
+# 带入下一活动提示词的前序事件条数；跨活动缓冲只保留这么多，提示词中的「最近N条」与实际条数一致
+PREVIOUS_EVENTS_CONTEXT = 2
+
 def _estimate_prompt_chars(template: str, variables: Dict[str, Any]) -> int:
     total = len(template or "")
     for val in variables.values():
@@ -412,7 +459,10 @@ def _normalize_device_patch(patch_dict: Dict[str, str]) -> Dict[str, str]:
 
 
 def _apply_device_patches(device_states: Dict, events: List[Any]) -> None:
-    """按事件顺序将 device_patches 合并到 device_states（原地修改）。device_id 统一 strip 后写入，与物理引擎查找一致。"""
+    """按事件顺序将 device_patches 合并到 device_states（原地修改）。device_id 统一 strip 后写入，与物理引擎查找一致。
+
+    单个设备的状态 dict 一律整体替换（写时复制），从不原地修改；因此 device_states 的快照只需浅拷贝外层 dict。
+    """
     for ev in events:
         if isinstance(ev, dict):
             patches = ev.get("device_patches", []) or []
@@ -614,7 +664,7 @@ def _backfill_room_environment_at_event_end(
         if not events_in_act:
             continue
         snap = {k: copy.deepcopy(v) for k, v in (snapshot_at_activity_start.get(aid) or {}).items()}
-        dev = copy.deepcopy(device_states_at_activity_start.get(aid) or {})
+        dev = dict(device_states_at_activity_start.get(aid) or {})
         target_rooms = act.get("main_rooms") or []
         if not target_rooms:
             continue
@@ -649,7 +699,7 @@ def _refine_room_environment_for_long_activity(
     """对长活动内的事件逐事件推进物理并写入 room_environment（原地修改 events）。每个事件的 room_environment 为该事件结束后的房间状态（先应用本事件 device_patches 再推进到 end_time）。"""
     import copy
     snapshot = {k: copy.deepcopy(v) for k, v in (snapshot_at_start or {}).items()}
-    device_states = copy.deepcopy(device_states_at_start or {})
+    device_states = dict(device_states_at_start or {})
     outdoor = outdoor_weather or {}
     ordered = sorted([e for e in events if e.get("room_id") and e.get("room_id") != "Outside"], key=lambda x: (x.get("start_time") or ""))
     for ev in ordered:
@@ -720,14 +770,32 @@ def _canonical_room_id(room_id: str, layout_rooms: set) -> Optional[str]:
     return None
 
 
-def _build_room_item_map(full_layout: Dict) -> Dict[str, set]:
-    """layout 中每房间的 (furniture + devices) ID 集合，用于「物品是否在该房间」校验。"""
+_LAYOUT_INDEX_CACHE: Dict[int, Tuple[Dict, Dict[str, frozenset], str]] = {}
+
+
+def _layout_index(full_layout: Dict) -> Tuple[Dict[str, frozenset], str]:
+    """
+    layout 派生数据（每房间物品 ID 集合、房间列表 JSON）按 layout 对象缓存：整个运行期 layout 不变，
+    不必每个活动/每轮校验都重建。缓存项保留 layout 引用并核对 is，避免 id 复用命中旧数据。
+    """
+    cached = _LAYOUT_INDEX_CACHE.get(id(full_layout))
+    if cached is not None and cached[0] is full_layout:
+        return cached[1], cached[2]
     room_item_map = {}
     for room_id, room_data in (full_layout or {}).items():
         furniture_ids = room_data.get("furniture", [])
         device_ids = room_data.get("devices", [])
-        room_item_map[room_id] = set(furniture_ids + device_ids)
-    return room_item_map
+        room_item_map[room_id] = frozenset(furniture_ids + device_ids)
+    room_list_json = json_dumps(list((full_layout or {}).keys()))
+    if len(_LAYOUT_INDEX_CACHE) >= 8:
+        _LAYOUT_INDEX_CACHE.clear()
+    _LAYOUT_INDEX_CACHE[id(full_layout)] = (full_layout, room_item_map, room_list_json)
+    return room_item_map, room_list_json
+
+
+def _build_room_item_map(full_layout: Dict) -> Dict[str, frozenset]:
+    """layout 中每房间的 (furniture + devices) ID 集合，用于「物品是否在该房间」校验。"""
+    return _layout_index(full_layout)[0]
 
 
 def _check_target_objects_in_room(events: List[EventItem], full_layout: Dict) -> Optional[str]:
@@ -735,7 +803,7 @@ def _check_target_objects_in_room(events: List[EventItem], full_layout: Dict) ->
     if not full_layout or not events:
         return None
     room_item_map = _build_room_item_map(full_layout)
-    layout_rooms = set(full_layout.keys())
+    layout_rooms = room_item_map.keys()
     for i, evt in enumerate(events):
         room_id = getattr(evt, "room_id", "") or ""
         if room_id == "Outside":
@@ -758,7 +826,7 @@ def _check_target_objects_in_room(events: List[EventItem], full_layout: Dict) ->
 def _sanitize_events(events: List[EventItem], full_layout: Dict) -> None:
     """按 layout 修正：事件房间规范化、且 target_object_ids 只保留该房间内存在的物品（不在该房间的从列表中移除）。"""
     room_item_map = _build_room_item_map(full_layout)
-    layout_rooms = set(full_layout.keys()) if full_layout else set()
+    layout_rooms = room_item_map.keys()
 
     for evt in events:
         room_id = evt.room_id
@@ -784,7 +852,7 @@ def _sanitize_events_dicts(events: List[Dict], full_layout: Dict) -> None:
     if not events or not full_layout:
         return
     room_item_map = _build_room_item_map(full_layout)
-    layout_rooms = set(full_layout.keys())
+    layout_rooms = room_item_map.keys()
     for ev in events:
         if not isinstance(ev, dict):
             continue
@@ -966,6 +1034,144 @@ def _check_description_device_alignment(events: List[Any]) -> Optional[str]:
     return None
 
 
+# 可承担房间切换的动作（出门本身即一次切换）
+_TRANSITION_ACTIONS = frozenset({"move", "outside"})
+
+
+def _parse_iso_naive(s: str) -> Optional[datetime]:
+    """_safe_parse_iso 后去掉时区：LLM 可能混用带 Z/偏移与不带时区的写法，统一为朴素时间再比较，避免 TypeError。"""
+    dt = _safe_parse_iso(s)
+    return dt.replace(tzinfo=None) if dt is not None else None
+
+
+def _local_event_problems(events: List[EventItem], activity: Dict, full_layout: Dict) -> Tuple[List[str], List[str]]:
+    """
+    审核提示词中可机械判定的维度（房间合法、物品归属、时间连续与覆盖父活动、换房间需 move）的本地实现。
+    返回 (结构问题, 时间问题)：仅有时间问题时可交给 _fit_event_times 本地修正，不必走 LLM 修正。
+    """
+    problems: List[str] = []
+    time_problems: List[str] = []
+    room_item_map = _build_room_item_map(full_layout)
+    layout_rooms = room_item_map.keys()
+
+    for i, ev in enumerate(events):
+        if ev.room_id == "Outside":
+            if ev.target_object_ids:
+                problems.append(f"事件[{i}] room_id 为 Outside，target_object_ids 必须为空")
+            continue
+        canonical = _canonical_room_id(ev.room_id, layout_rooms)
+        if not canonical:
+            problems.append(f"事件[{i}] 的 room_id「{ev.room_id}」不在房间列表中")
+            continue
+        stray = [oid for oid in ev.target_object_ids if oid not in room_item_map[canonical]]
+        if stray:
+            problems.append(f"事件[{i}] 的物品 {stray} 不属于房间 {canonical}")
+
+    times = [(_parse_iso_naive(ev.start_time), _parse_iso_naive(ev.end_time)) for ev in events]
+    # 房间切换按规范化后的房间 ID 判断，'Living Room' 与 living_room 不算切换；无法识别的房间已记为结构问题，按原值比较
+    rooms = [_canonical_room_id(ev.room_id, layout_rooms) or ev.room_id for ev in events]
+    for i, (st, et) in enumerate(times):
+        if st is None or et is None:
+            time_problems.append(f"事件[{i}] 的 start_time/end_time 不是合法 ISO 时间")
+        elif et <= st:
+            time_problems.append(f"事件[{i}] 时长不为正（{events[i].start_time} → {events[i].end_time}）")
+    for i in range(len(events) - 1):
+        if times[i][1] is not None and times[i + 1][0] is not None and times[i][1] != times[i + 1][0]:
+            time_problems.append(f"事件[{i}].end_time ({events[i].end_time}) 与事件[{i+1}].start_time ({events[i+1].start_time}) 不衔接")
+        if rooms[i] != rooms[i + 1] and not _TRANSITION_ACTIONS & {
+            events[i].action_type.lower(), events[i + 1].action_type.lower()
+        }:
+            problems.append(f"事件[{i}]→[{i+1}] 从 {rooms[i]} 切换到 {rooms[i+1]}，缺少 move 事件")
+
+    act_st = _parse_iso_naive(activity.get("start_time", ""))
+    act_et = _parse_iso_naive(activity.get("end_time", ""))
+    if events and act_st is not None and times[0][0] is not None and times[0][0] != act_st:
+        time_problems.append(f"首个事件 start_time ({events[0].start_time}) 必须等于父活动 start_time ({activity.get('start_time')})")
+    if events and act_et is not None and times[-1][1] is not None and times[-1][1] != act_et:
+        time_problems.append(f"最后一个事件 end_time ({events[-1].end_time}) 必须等于父活动 end_time ({activity.get('end_time')})")
+
+    return problems, time_problems
+
+
+def _fatal_activity_reason(activity: Dict, full_layout: Dict) -> Optional[str]:
+    """父活动层面无法靠修正事件解决的问题：main_rooms 全不在 layout 中（且非 Outside），或活动时间窗不可解析/非正。"""
+    main_rooms = activity.get("main_rooms") or []
+    if main_rooms and full_layout:
+        layout_rooms = _build_room_item_map(full_layout).keys()
+        if not any(r == "Outside" or _canonical_room_id(r, layout_rooms) for r in main_rooms):
+            return f"main_rooms {main_rooms} 均不在 house_layout 中"
+    act_st = _safe_parse_iso(activity.get("start_time", ""))
+    act_et = _safe_parse_iso(activity.get("end_time", ""))
+    if act_st is None or act_et is None:
+        return "活动 start_time/end_time 无法解析"
+    if act_et.replace(tzinfo=None) <= act_st.replace(tzinfo=None):
+        return f"活动时间窗非正（{activity.get('start_time')} → {activity.get('end_time')}）"
+    return None
+
+
+def _validate_events_local(events: List[EventItem], activity: Dict, full_layout: Dict) -> ValidationResult:
+    """本地确定性审核；只有时间问题时先按比例修正时间轴（原地修改 events），修正后仍有问题才交给 LLM 修正。"""
+    problems, time_problems = _local_event_problems(events, activity, full_layout)
+    if time_problems and not problems and _fit_event_times(events, activity):
+        logger.info("[FIX] 事件时间轴已按父活动区间本地修正（%d 处时间问题）", len(time_problems))
+        problems, time_problems = _local_event_problems(events, activity, full_layout)
+    problems += time_problems
+    if not problems:
+        return ValidationResult(is_valid=True, correction_content=None)
+    return ValidationResult(is_valid=False, correction_content="本地校验未通过：" + "；".join(problems) + "。")
+
+
+# 修正时间轴时单个事件的最小权重（秒），零时长/倒挂事件按此参与比例分配
+_MIN_EVENT_SECONDS = 30
+
+
+def _format_like(dt: datetime, original: str) -> str:
+    """把朴素时间按 original 的时区写法写出：original 带 Z 则写 Z，带偏移则用该偏移，否则不带时区。"""
+    t = (original or "").strip()
+    if t.endswith("Z"):
+        return dt.strftime("%Y-%m-%dT%H:%M:%S") + "Z"
+    parsed = _safe_parse_iso(t)
+    if parsed is not None and parsed.tzinfo is not None:
+        return dt.replace(tzinfo=parsed.tzinfo).isoformat(timespec="seconds")
+    return dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _fit_event_times(events: List[EventItem], activity: Dict) -> bool:
+    """
+    按各事件声明时长的比例把事件首尾相接地铺满父活动区间（整秒），原地改写 start_time/end_time。
+    新时间由父活动的墙钟时间推算，统一按父活动 start_time 的时区写法写出（不沿用各事件原来的写法，
+    否则混用 Z 与 +08:00 时同一墙钟时间会指向不同时刻）。
+    时间无法解析或区间过短无法给每个事件分到至少 1 秒时不做修改并返回 False。
+    """
+    act_st = _parse_iso_naive(activity.get("start_time", ""))
+    act_et = _parse_iso_naive(activity.get("end_time", ""))
+    if not events or act_st is None or act_et is None:
+        return False
+    window = int((act_et - act_st).total_seconds())
+    if window < len(events):
+        return False
+    weights = []
+    for ev in events:
+        st, et = _parse_iso_naive(ev.start_time), _parse_iso_naive(ev.end_time)
+        if st is None or et is None:
+            return False
+        weights.append(max((et - st).total_seconds(), _MIN_EVENT_SECONDS))
+    total = sum(weights)
+    bounds = [0]
+    acc = 0.0
+    for w in weights[:-1]:
+        acc += w
+        bounds.append(max(bounds[-1] + 1, round(window * acc / total)))
+    bounds.append(window)
+    if bounds[-2] >= window:
+        return False
+    notation = activity.get("start_time", "")
+    for ev, b0, b1 in zip(events, bounds, bounds[1:]):
+        ev.start_time = _format_like(act_st + timedelta(seconds=b0), notation)
+        ev.end_time = _format_like(act_st + timedelta(seconds=b1), notation)
+    return True
+
+
 def _is_retryable_llm_error(e: Exception) -> bool:
     """判断是否为可重试的 LLM 调用错误（连接、SSL、超时、限流、5xx）。"""
     def msg_and_cause(exc: Exception) -> str:
@@ -1017,8 +1223,34 @@ def _is_retryable_llm_error(e: Exception) -> bool:
     return False
 
 
+# 精确匹配缓存：label -> (提示词模板, 输出模型)，模板参与缓存键，改提示词后旧结果自动失效
+_CACHEABLE_CALLS = {
+    "event_generate_segment": (_GENERATION_TEMPLATE, EventSequence),
+    "event_generate": (_GENERATION_TEMPLATE, EventSequence),
+    "event_validate": (_VALIDATION_TEMPLATE, ValidationResult),
+    "event_correct": (_CORRECTION_TEMPLATE, EventSequence),
+}
+_llm_cache = ResultCache(project_root / "data" / "event_llm_cache.sqlite", "event_llm_cache")
+
+
 def _invoke_chain_with_retry(chain, inputs: Dict[str, Any], label: str = "LLM"):
-    """对单次 chain.invoke 做内层重试，吸收瞬时连接/5xx 错误。"""
+    """对单次 chain.invoke 做内层重试，吸收瞬时连接/5xx 错误。开启 EVENT_LLM_CACHE 时先查精确匹配缓存。"""
+    spec = _CACHEABLE_CALLS.get(label) if EVENT_LLM_CACHE else None
+    if spec is None:
+        return _invoke_with_inner_retry(chain, inputs, label)
+    template, output_model = spec
+    # 按实际调用的模型入键（设了 OPENAI_MODEL 时 EVENT_MODEL 会被覆盖），换模型后不复用旧结果
+    key = cache_key(llm.model_name, EVENT_TEMPERATURE, template, inputs)
+    cached = _llm_cache.get(key, output_model)
+    if cached is not None:
+        logger.info("[%s] 命中 LLM 结果缓存", label)
+        return cached
+    result = _invoke_with_inner_retry(chain, inputs, label)
+    _llm_cache.put(key, result)
+    return result
+
+
+def _invoke_with_inner_retry(chain, inputs: Dict[str, Any], label: str):
     last_exc = None
     for attempt in range(INNER_LLM_RETRY_COUNT + 1):
         try:
@@ -1064,19 +1296,18 @@ def generate_events_node(state: EventState):
     env_note = "\n**说明**：居民档案（含 preferences 等）已在上方提供。是否插入调节事件、插入何种事件，请根据档案中的偏好与当前房间环境综合判断，由你根据常识与性格推断。"
 
     # 3. 调用 LLM（迭代：每段生成后物理推进，下一段基于新环境；非迭代：一次性生成）
-    prompt = ChatPromptTemplate.from_template(EVENT_GENERATION_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(EventSequence, method="json_schema", strict=True)
-    chain = prompt | structured_llm
+    chain = _GENERATE_CHAIN
 
-    activity_str = json.dumps(state["current_activity"], ensure_ascii=False)
-    prev_events_str = json.dumps(state["previous_events"][-2:], ensure_ascii=False) if state["previous_events"] else "[]"
+    activity_str = json_dumps(state["current_activity"])
+    prev_events_str = json_dumps(state["previous_events"][-PREVIOUS_EVENTS_CONTEXT:]) if state["previous_events"] else "[]"
 
     if USE_ITERATIVE_EVENT_GENERATION:
         import copy
         current_time = activity_start
         seg_snapshot = copy.deepcopy(updated_snapshot)
-        seg_device_states = copy.deepcopy(device_states)
+        seg_device_states = dict(device_states)
         all_events: List[EventItem] = []
+        events_so_far: List[Dict] = []  # all_events 的 dict 形式，逐段追加，避免每段把已生成事件全部重新 model_dump
         segment_index = 0
         while current_time < activity_end:
             segment_index += 1
@@ -1085,13 +1316,12 @@ def generate_events_node(state: EventState):
             comfort_mandate = _evaluate_comfort_and_build_mandate(seg_snapshot, target_rooms, state.get("resident_profile") or "{}")
             room_env_text += "\n\n**环境评估与必须响应**：\n" + comfort_mandate
             logger.info("Event segment env (passed to LLM): %s", (room_env_text[:200] + "..." if len(room_env_text) > 200 else room_env_text))
-            events_so_far = [e.model_dump() for e in all_events]
             segment_instruction = (
                 " **本段生成**：当前时刻为 " + current_time + "。请从该时刻起生成事件，首条事件 start_time 必须等于当前时刻；"
                 "连续生成直至活动结束或本段约 20–30 分钟。上方「当前房间环境」为该时刻**先跑物理引擎**得到的真实数据；"
                 "若「环境评估与必须响应」中列出某房间超出舒适范围，请在本段中**首先生成**人物主动调节设备的事件，并填写 device_patches。"
                 "人物在本段的设备操作（开暖气/开窗/净化器等）会在**同一活动内**即时参与物理计算，下一段将看到调节后的环境。"
-                "已生成事件（供衔接）：" + json.dumps(events_so_far, ensure_ascii=False)
+                "已生成事件（供衔接）：" + json_dumps(events_so_far)
             )
             if state.get("day_index") == 7:
                 segment_instruction += (
@@ -1099,15 +1329,13 @@ def generate_events_node(state: EventState):
                 )
             print(f"  [LLM] Generating events segment {segment_index} from {current_time}...", flush=True)
             result = _invoke_chain_with_retry(chain, {
-                "event_requirements": EVENT_REQUIREMENTS,
-                "values_interpretation_guide": VALUES_INTERPRETATION_GUIDE,
                 "resident_profile_json": state["resident_profile"],
                 "agent_state_json": state.get("agent_state_json", "{}"),
                 "room_list_json": context_data["room_list_json"],
                 "furniture_details_json": context_data["furniture_details_json"],
                 "current_room_environment": room_env_text,
                 "current_activity_json": activity_str,
-                "context_size": 5,
+                "context_size": PREVIOUS_EVENTS_CONTEXT,
                 "previous_events_context": prev_events_str,
                 "segment_instruction": segment_instruction,
             }, label="event_generate_segment")
@@ -1136,12 +1364,15 @@ def generate_events_node(state: EventState):
                     logger.warning("强制前进时间解析失败: %s，直接设为 activity_end。", e)
                     current_time = activity_end
             all_events.extend(result.events)
+            # 本段事件只 dump 一次：设备合并、物理推进与下一段的衔接上下文共用（三者都只读）
+            segment_dicts = [e.model_dump() for e in result.events]
+            events_so_far.extend(segment_dicts)
             # 环境及时反馈：本段人物改设备（device_patches）立即写入 seg_device_states，再按事件顺序推进物理到本段结束时刻；
             # 下一段的 current_room_environment 来自 seg_snapshot，因此会看到本段开暖气/开窗等带来的温度/空气变化。
-            _apply_device_patches(seg_device_states, [e.model_dump() for e in result.events])
+            _apply_device_patches(seg_device_states, segment_dicts)
             seg_snapshot = _advance_snapshot_through_events(
                 seg_snapshot,
-                [e.model_dump() for e in result.events],
+                segment_dicts,
                 seg_device_states,
                 full_layout,
                 details_map,
@@ -1183,15 +1414,13 @@ def generate_events_node(state: EventState):
         logger.info("Event one-shot env (passed to LLM): %s", (room_env_text[:200] + "..." if len(room_env_text) > 200 else room_env_text))
         print("  [LLM] Generating events (may take 10-60s)...", flush=True)
         result = _invoke_chain_with_retry(chain, {
-            "event_requirements": EVENT_REQUIREMENTS,
-            "values_interpretation_guide": VALUES_INTERPRETATION_GUIDE,
             "resident_profile_json": state["resident_profile"],
             "agent_state_json": state.get("agent_state_json", "{}"),
             "room_list_json": context_data["room_list_json"],
             "furniture_details_json": context_data["furniture_details_json"],
             "current_room_environment": room_env_text,
             "current_activity_json": activity_str,
-            "context_size": 5,
+            "context_size": PREVIOUS_EVENTS_CONTEXT,
             "previous_events_context": prev_events_str,
             "segment_instruction": segment_instruction,
         }, label="event_generate")
@@ -1205,7 +1434,7 @@ def generate_events_node(state: EventState):
                 "furniture_details_json": context_data["furniture_details_json"],
                 "current_room_environment": room_env_text,
                 "current_activity_json": activity_str,
-                "context_size": 5,
+                "context_size": PREVIOUS_EVENTS_CONTEXT,
                 "previous_events_context": prev_events_str,
                 "segment_instruction": segment_instruction,
             }
@@ -1235,6 +1464,7 @@ def generate_events_node(state: EventState):
     return {
         "current_events": result,
         "room_context_data": context_data,
+        "current_activity_json": activity_str,
         "revision_count": 0,
         "environment_snapshot": snapshot_at_end,
         "environment_snapshot_at_activity_start": updated_snapshot,
@@ -1243,17 +1473,20 @@ def generate_events_node(state: EventState):
 
 def validate_events_node(state: EventState):
     logger.info(" [Step 2] Validating Events...")
-    prompt = ChatPromptTemplate.from_template(EVENT_VALIDATION_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(ValidationResult, method="json_schema", strict=True)
-    chain = prompt | structured_llm
+    if EVENT_LOCAL_VALIDATION:
+        result = _validate_events_local(
+            state["current_events"].events, state["current_activity"], state.get("full_layout") or {}
+        )
+        return _apply_hard_checks(state, result)
+
+    chain = _VALIDATE_CHAIN
     
     events_json = state["current_events"].model_dump_json()
-    activity_str = json.dumps(state["current_activity"], ensure_ascii=False)
+    activity_str = state.get("current_activity_json") or json_dumps(state["current_activity"])
     layout_summary = state["room_context_data"]["furniture_details_json"]
     
     print("  [LLM] Validating events (may take 5-30s)...", flush=True)
     result = _invoke_chain_with_retry(chain, {
-        "event_requirements": EVENT_REQUIREMENTS,
         "house_layout_summary": layout_summary,
         "current_activity_json": activity_str,
         "agent_state_json": state.get("agent_state_json", "{}"),
@@ -1271,7 +1504,11 @@ def validate_events_node(state: EventState):
         logger.info(f"LLM input size (event validate): ~{chars} chars (~{chars//4} tokens)")
     except Exception:
         pass
+    return _apply_hard_checks(state, result)
+
 
+def _apply_hard_checks(state: EventState, result: ValidationResult):
+    """在审核结果（LLM 或本地）之上叠加硬校验与环境校验。"""
     # 硬校验：start_time/end_time 不得包含 Schema 幻觉（如 :string、:number），必须为合法 ISO
     try:
         for i, ev in enumerate(state["current_events"].events):
@@ -1465,22 +1702,20 @@ def validate_events_node(state: EventState):
         logger.info("[OK] Validation Passed!")
     else:
         logger.warning(f"[FAIL] Validation Failed: {result.correction_content[:100] if result.correction_content else ''}...")
-    return {"validation_result": result}
+    fatal = None if result.is_valid else _fatal_activity_reason(state["current_activity"], state.get("full_layout") or {})
+    return {"validation_result": result, "validation_fatal": fatal}
 
 def correct_events_node(state: EventState):
     import copy
     logger.info(f"[Step 3] Correcting Events (Attempt {state['revision_count'] + 1})...")
-    prompt = ChatPromptTemplate.from_template(EVENT_CORRECTION_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(EventSequence, method="json_schema", strict=True)
-    chain = prompt | structured_llm
+    chain = _CORRECT_CHAIN
 
     events_json = state["current_events"].model_dump_json()
-    activity_str = json.dumps(state["current_activity"], ensure_ascii=False)
+    activity_str = state.get("current_activity_json") or json_dumps(state["current_activity"])
     layout_summary = state["room_context_data"]["furniture_details_json"]
 
     print("  [LLM] Correcting events (may take 10-40s)...", flush=True)
     result = _invoke_chain_with_retry(chain, {
-        "event_requirements": EVENT_REQUIREMENTS,
         "resident_profile_json": state["resident_profile"],
         "furniture_details_json": layout_summary,
         "current_activity_json": activity_str,
@@ -1503,6 +1738,11 @@ def correct_events_node(state: EventState):
     except Exception:
         pass
 
+    if result.model_dump_json() == events_json:
+        # 修正结果与上一版完全一致：环境/设备推进结果也不变，跳过推进与下一轮校验
+        logger.warning("[WARN] Correction returned identical events, stopping revisions for this activity.")
+        return {"revision_count": state["revision_count"] + 1, "correction_stalled": True}
+
     # 用修正后事件的副本做物理推进（sanitize 副本保证一致性）；不 sanitize result.events，以便下一轮 validate 继续校验「物品须在该房间」
     events_for_snapshot = copy.deepcopy(result.events)
     _sanitize_events(events_for_snapshot, state["full_layout"])
@@ -1510,7 +1750,7 @@ def correct_events_node(state: EventState):
     activity_start = state["current_activity"].get("start_time", "")
     activity_end = state["current_activity"].get("end_time", activity_start)
     snap_start = copy.deepcopy(state.get("environment_snapshot_at_activity_start") or {})
-    dev_states = copy.deepcopy(state.get("device_states") or {})
+    dev_states = dict(state.get("device_states") or {})
     outdoor = state.get("outdoor_weather") or {}
     full_layout = state.get("full_layout") or {}
     details_map = state.get("details_map") or {}
@@ -1537,9 +1777,15 @@ def correct_events_node(state: EventState):
         "device_states": dev_states,
     }
 
+def after_correct_router(state: EventState):
+    return "end" if state.get("correction_stalled") else "validate"
+
 def router(state: EventState):
     if state["validation_result"].is_valid:
         return "end"
+    if state.get("validation_fatal"):
+        logger.error("[WARN] Activity cannot be satisfied (%s), skipping correction.", state["validation_fatal"])
+        return "end"
     if state["revision_count"] >= MAX_EVENT_REVISIONS:
         logger.error("[WARN] Max revisions reached. Skipping this activity.")
         return "end"
@@ -1553,7 +1799,7 @@ workflow.add_node("correct", correct_events_node)
 workflow.set_entry_point("generate")
 workflow.add_edge("generate", "validate")
 workflow.add_conditional_edges("validate", router, {"end": END, "correct": "correct"})
-workflow.add_edge("correct", "validate")
+workflow.add_conditional_edges("correct", after_correct_router, {"end": END, "validate": "validate"})
 app = workflow.compile()
 
 # ==========================================
@@ -1583,7 +1829,7 @@ def run_batch_processing(
             with open(sim_context_path, "r", encoding="utf-8") as f:
                 sim_ctx = json.load(f)
             agent_state = sim_ctx.get("agent_state", {})
-            agent_state_json = json.dumps(agent_state, ensure_ascii=False, indent=2)
+            agent_state_json = json_dumps(agent_state, indent=PROMPT_JSON_INDENT)
         except Exception:
             agent_state_json = "{}"
 
@@ -1598,6 +1844,17 @@ def run_batch_processing(
             activity_data = json.load(f)
             activities_list = activity_data.get("activities", [])
 
+    # HH:MM 补齐为 HH:MM:SS，在进入循环前一次完成；时间字段缺失/非字符串的活动记下，循环中记录并跳过，不影响当日其余活动
+    malformed_activities = set()
+    for index, activity in enumerate(activities_list):
+        try:
+            for key in ("start_time", "end_time"):
+                if len(activity[key]) == 5:
+                    activity[key] += ":00"
+        except Exception as e:
+            malformed_activities.add(index)
+            logger.error(f"[ERROR] Activity [{index+1}] has malformed start_time/end_time ({e!r}), skipping it.")
+
     print(f"\n Starting Batch Processing for {len(activities_list)} activities...\n")
     if SKIP_EVENT_VALIDATION:
         print("[FAST] SIM_SKIP_EVENT_VALIDATION=1: 跳过校验/修正，每活动仅 1 次生成，提速明显。\n")
@@ -1666,11 +1923,6 @@ def run_batch_processing(
                     device_states[sid] = dict((details_map.get(sid) or details_map.get(did) or {}).get("current_state") or {})
 
     def _process_one(index: int, activity: Dict, prev_events: List[Dict], env_snapshot: Dict, dev_states: Dict):
-        if len(activity["start_time"]) == 5:
-            activity["start_time"] = f"{activity['start_time']}:00"
-        if len(activity["end_time"]) == 5:
-            activity["end_time"] = f"{activity['end_time']}:00"
-
         state = {
             "resident_profile": settings["profile_json"],
             "full_layout": settings["house_layout"],
@@ -1702,12 +1954,14 @@ def run_batch_processing(
         return index, activity, None, "no_events", env_snapshot, dev_states, env_snapshot
 
     for index, activity in enumerate(activities_list):
+        if index in malformed_activities:
+            continue
         print(f"--- Processing [{index+1}/{len(activities_list)}]: {activity['activity_name']} ---", flush=True)
         last_exc = None
         for attempt in range(LLM_RETRY_COUNT + 1):
             try:
-                import copy as _copy_mod
-                device_states_at_activity_start[activity.get("activity_id", "")] = _copy_mod.deepcopy(device_states)
+                # 设备状态写时复制（见 _apply_device_patches），浅拷贝即可得到独立快照
+                device_states_at_activity_start[activity.get("activity_id", "")] = dict(device_states)
                 idx, act, new_events, err, updated_snapshot, updated_device_states, snap_at_start = _process_one(
                     index, activity, context_events_buffer, environment_snapshot, device_states
                 )
@@ -1753,7 +2007,7 @@ def run_batch_processing(
                 # 收集前按 layout 做一次「物品须在该事件房间」的 sanitize，与 validate 硬校验一致
                 _sanitize_events_dicts(new_events, settings.get("house_layout") or {})
                 all_generated_events.extend(new_events)
-                context_events_buffer = new_events[-5:]
+                context_events_buffer = new_events[-PREVIOUS_EVENTS_CONTEXT:]
                 print(f"[OK] Generated {len(new_events)} events for {activity['activity_name']}.", flush=True)
                 last_exc = None
                 break
@@ -1843,8 +2097,8 @@ def run_batch_processing(
             "note": "environment_by_activity: 每个活动开始时各房间的温度/湿度/清洁度，用于 event 生成推理；每个 event 的 room_environment 为该事件所在房间的该时刻环境。",
         },
     }
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=2, ensure_ascii=False)
+    # 整体编码后一次写出，比 json.dump 逐块写文件快；落盘文件统一用标准库 json 编码，内容不随是否装有 orjson 而变
+    output_file.write_text(json.dumps(payload, indent=None if COMPACT_JSON else 2, ensure_ascii=False), encoding="utf-8")
 
     # 返回当日结束时的房间环境与设备状态，供多日仿真中下一日作为初值使用（保证 Day2+ 初始/最终环境一致）
     result = {
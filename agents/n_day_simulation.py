@@ -1,10 +1,14 @@
+import atexit
 import json
 import os
+import queue
 import random
 import sys
-from datetime import date, datetime, timedelta
+import threading
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
 from pathlib import Path
-from typing import Dict, Optional, Tuple, List
+from typing import Dict, Optional, Tuple, List, Union
 
 from dotenv import load_dotenv
 
@@ -30,9 +34,9 @@ from agent_config import (
     RANDOM_SEED,
     FORCE_DAY1_STATE,
     COMPACT_JSON,
+    PROMPT_JSON_INDENT,
 )
 
-load_dotenv()
 dotenv_path = project_root / ".env"
 load_dotenv(dotenv_path=dotenv_path)
 
@@ -43,21 +47,86 @@ def _ensure_dir(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 
-def _write_json(path: Path, payload: Dict) -> None:
-    _ensure_dir(path)
+# 后台写盘：主循环只做序列化，文件写入交给单个守护线程，与后续 LLM 调用重叠；单线程 FIFO 保证同一文件按提交顺序落盘
+# data 为 bytes 时直接写入；为 Path 时表示归档复制，读取、解析与重新编码都在写盘线程完成
+_write_queue: "queue.Queue[Tuple[Path, Union[bytes, Path]]]" = queue.Queue()
+_writer_lock = threading.Lock()
+_writer_thread: Optional[threading.Thread] = None
+_write_error: Optional[BaseException] = None
+
+
+def _encode_json(payload: Dict) -> bytes:
     indent = None if COMPACT_JSON else 2
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=indent, ensure_ascii=False)
+    return json.dumps(payload, indent=indent, ensure_ascii=False).encode("utf-8")
+
+
+def _writer_loop() -> None:
+    while True:
+        path, data = _write_queue.get()
+        try:
+            if isinstance(data, Path):
+                if not data.exists():
+                    continue
+                data = _encode_json(json.loads(data.read_bytes()))
+            _ensure_dir(path)
+            path.write_bytes(data)
+        except Exception as exc:
+            global _write_error
+            print(f"[ERROR] Failed to write {path}: {exc}")
+            # 只保留第一个异常，由 _flush_writes 在主线程重新抛出
+            if _write_error is None:
+                _write_error = exc
+        finally:
+            _write_queue.task_done()
+
+
+def _enqueue_write(path: Path, data: Union[bytes, Path]) -> None:
+    """入队一次写盘；写盘线程在第一次入队时才启动，导入本模块不会产生线程。"""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="json-writer", daemon=True)
+            _writer_thread.start()
+    _write_queue.put((path, data))
+
+
+def _flush_writes() -> None:
+    """等待排队的写盘全部完成；其他模块要从 data/ 读取这些文件前必须调用。期间有写盘失败时重新抛出第一个异常。"""
+    global _write_error
+    _write_queue.join()
+    err, _write_error = _write_error, None
+    if err is not None:
+        raise err
+
+
+# 异常退出时也把已排队的文件写完（只等待，不在退出阶段再抛异常）
+atexit.register(_write_queue.join)
+
+
+def _write_json(path: Path, payload: Dict, *extra_paths: Path) -> None:
+    """序列化一次，写入 path 及 extra_paths（内容相同的「最新」文件与按日归档文件共用同一份编码结果）。"""
+    # 在调用线程序列化：payload 之后还会被修改，落盘内容必须是此刻的快照
+    data = _encode_json(payload)
+    for p in (path, *extra_paths):
+        _enqueue_write(p, data)
 
 def _write_simulation_context(day_index: int, payload: Dict) -> None:
-    _write_json(DATA_DIR / "simulation_context.json", payload)
-    _write_json(DATA_DIR / f"simulation_context_day{day_index}.json", payload)
+    _write_json(
+        DATA_DIR / "simulation_context.json",
+        payload,
+        DATA_DIR / f"simulation_context_day{day_index}.json",
+    )
+
+
+_STATES = ("Normal", "Perturbed", "Crisis")
+# 累积权重在导入时算好，random.choices 无需每次重新累加
+_CUM_WEIGHTS = tuple(accumulate((NORMAL_WEIGHT, PERTURBED_WEIGHT, CRISIS_WEIGHT)))
 
 
 def _pick_state() -> str:
-    states = ["Normal", "Perturbed", "Crisis"]
-    weights = [NORMAL_WEIGHT, PERTURBED_WEIGHT, CRISIS_WEIGHT]
-    return random.choices(states, weights=weights, k=1)[0]
+    if FORCE_DAY1_STATE:
+        return FORCE_DAY1_STATE
+    return random.choices(_STATES, cum_weights=_CUM_WEIGHTS, k=1)[0]
 
 
 def _build_simulation_context(
@@ -74,8 +143,6 @@ def _build_simulation_context(
     day_type = "weekend" if day_of_week in {"Saturday", "Sunday"} else "workday"
 
     simulation_state = _pick_state()
-    if FORCE_DAY1_STATE:
-        simulation_state = FORCE_DAY1_STATE
     random_event = ""
     emergency_event = ""
     random_event_count = 0
@@ -115,11 +182,8 @@ def _build_simulation_context(
 
 
 def _copy_json(src: Path, dst: Path) -> None:
-    if not src.exists():
-        return
-    with open(src, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    _write_json(dst, data)
+    """归档复制整体交给写盘线程。src 在下一次 _flush_writes 之前不会被改写（event/device 层运行前都会先 flush）。"""
+    _enqueue_write(dst, src)
 
 
 def _parse_iso(dt_str: str) -> datetime:
@@ -158,6 +222,17 @@ def _get_sleep_cutoff(activities: List[Dict]) -> Optional[datetime]:
     return None
 
 
+# "HH:MM" -> time 解析缓存：作息时间每天重复解析同几个字符串
+_CLOCK_CACHE: Dict[str, time] = {}
+
+
+def _parse_clock(hhmm: str) -> time:
+    parsed = _CLOCK_CACHE.get(hhmm)
+    if parsed is None:
+        parsed = _CLOCK_CACHE[hhmm] = datetime.strptime(hhmm, "%H:%M").time()
+    return parsed
+
+
 def _get_wake_time(profile: Dict, target_date: date) -> datetime:
     routines = profile.get("routines", {})
     sleep_schedule = routines.get("sleep_schedule", {})
@@ -167,7 +242,7 @@ def _get_wake_time(profile: Dict, target_date: date) -> datetime:
         wake_str = sleep_schedule.get("weekday_wakeup", "07:00")
     else:
         wake_str = sleep_schedule.get("weekend_wakeup", "08:30")
-    return datetime.combine(target_date, datetime.strptime(wake_str, "%H:%M").time())
+    return datetime.combine(target_date, _parse_clock(wake_str))
 
 
 def _get_day_time_window(profile: Dict, current_date: date) -> Tuple[datetime, datetime]:
@@ -182,7 +257,7 @@ def _get_day_time_window(profile: Dict, current_date: date) -> Tuple[datetime, d
         bed_str = sleep_schedule.get("weekend_bedtime", "00:30")
 
     wake_time = _get_wake_time(profile, current_date)
-    bed_time = datetime.combine(current_date, datetime.strptime(bed_str, "%H:%M").time())
+    bed_time = datetime.combine(current_date, _parse_clock(bed_str))
     if bed_time <= wake_time:
         bed_time = bed_time + timedelta(days=1)
     # day_end_time set to next day's wake time to include sleep at day end
@@ -204,28 +279,26 @@ def _align_and_slice_activities(
         return activities, day_start
 
     delta = day_start - first_start
-    for activity in activities:
-        try:
-            start = _parse_iso(activity["start_time"]) + delta
-            end = _parse_iso(activity["end_time"]) + delta
-            activity["start_time"] = _format_iso(start)
-            activity["end_time"] = _format_iso(end)
-        except Exception:
-            continue
-
+    shift = bool(delta)
     cutoff = day_end_limit
 
+    # 平移与截断合并为一次遍历：每条活动的起止时间只解析/格式化一次，截断点之后的活动不再解析
+    # 首条活动已对齐（delta 为 0）时不做平移；仍需重新格式化，以规范 LLM 输出的截断 ISO
     sliced: List[Dict] = []
     for activity in activities:
         start = _parse_iso(activity["start_time"])
+        if shift:
+            start += delta
         if start >= cutoff:
             break
         end = _parse_iso(activity["end_time"])
+        if shift:
+            end += delta
+        activity["start_time"] = _format_iso(start)
+        activity["end_time"] = _format_iso(end)
+        sliced.append(activity)
         if end > cutoff:
-            activity["end_time"] = _format_iso(cutoff)
-            sliced.append(activity)
             break
-        sliced.append(activity)
 
     if not sliced:
         return sliced, cutoff
@@ -240,17 +313,17 @@ def _snapshot_from_chain(events: List[Dict]) -> Dict:
     device_states: Dict[str, Dict[str, str]] = {}
     for evt in events:
         layer = evt.get("layer5_device_state", {})
-        for patch in layer.get("patch_on_start", []) + layer.get("patch_on_end", []):
+        patches = layer.get("patch_on_start", []) + layer.get("patch_on_end", [])
+        for patch in patches:
             device_id = patch.get("device_id")
             patch_data = patch.get("patch", {})
             if not device_id:
                 continue
             if isinstance(patch_data, list):
                 patch_data = {p.get("key"): p.get("value") for p in patch_data if isinstance(p, dict) and p.get("key")}
-            state = device_states.setdefault(device_id, {})
-            for key, value in (patch_data or {}).items():
-                if key and value is not None:
-                    state[str(key)] = str(value)
+            device_states.setdefault(device_id, {}).update(
+                {str(key): str(value) for key, value in (patch_data or {}).items() if key and value is not None}
+            )
     device_power = {
         dev_id: {"power": state.get("power", "unknown")}
         for dev_id, state in device_states.items()
@@ -375,7 +448,11 @@ def run_multi_day_simulation() -> None:
     if (settings_dir / "profile.json").exists():
         with open(settings_dir / "profile.json", "r", encoding="utf-8") as f:
             profile_data = json.load(f)
-        profile_json = json.dumps(profile_data, ensure_ascii=False, indent=2)
+        # 只用于提示词（Event 档案、昨日总结），紧凑序列化以省输入 token
+        if PROMPT_JSON_INDENT:
+            profile_json = json.dumps(profile_data, ensure_ascii=False, indent=2)
+        else:
+            profile_json = json.dumps(profile_data, ensure_ascii=False, separators=(",", ":"))
     if (settings_dir / "house_layout.json").exists():
         with open(settings_dir / "house_layout.json", "r", encoding="utf-8") as f:
             layout_data = json.load(f)
@@ -395,7 +472,10 @@ def run_multi_day_simulation() -> None:
             "house_details_map": house_details_map,
         }
     if house_details_map is not None:
-        device_settings = {"house_details_map": house_details_map}
+        device_settings = {
+            "house_details_map": house_details_map,
+            "device_context_map": device_operate.build_device_context_map(house_details_map),
+        }
 
     event_config = profile_data.get("random_event_config") or {}
     previous_day_summary = "N/A"
@@ -407,6 +487,8 @@ def run_multi_day_simulation() -> None:
 
     action_chain = None
     for day_index in range(1, DAYS + 1):
+        # 上一日排队的写盘须先落盘，避免与本日 planning 同步写的 activity.json 交错
+        _flush_writes()
         print(f"\n=== Day {day_index}/{DAYS} ===", flush=True)
         current_date = base_date + timedelta(days=day_index - 1)
         day_start_time, day_end_limit = _get_day_time_window(profile_data, current_date)
@@ -472,8 +554,7 @@ def run_multi_day_simulation() -> None:
         )
         activity_plan["activities"] = aligned_activities
 
-        _write_json(DATA_DIR / "activity.json", activity_plan)
-        _write_json(DATA_DIR / f"activity_day{day_index}.json", activity_plan)
+        _write_json(DATA_DIR / "activity.json", activity_plan, DATA_DIR / f"activity_day{day_index}.json")
 
         simulation_context["agent_state"] = _update_agent_state_from_activities(
             simulation_context.get("agent_state", {}),
@@ -483,9 +564,11 @@ def run_multi_day_simulation() -> None:
         _write_simulation_context(day_index, simulation_context)
 
         if RUN_EVENTS:
+            # event 层会从 data/simulation_context.json 读取 agent_state 与室外天气
+            _flush_writes()
             print("  Event layer: LLM calls (10-60s per activity, please wait)...", flush=True)
             event_result = event.run_batch_processing(
-                activity_plan.get("activities", []),
+                aligned_activities,
                 cached_settings=event_settings,
                 initial_environment_snapshot=previous_day_env_snapshot,
                 initial_device_states=previous_day_device_states,
@@ -505,7 +588,7 @@ def run_multi_day_simulation() -> None:
             simulation_context["agent_state_stage"] = "after_events"
             _write_simulation_context(day_index, simulation_context)
 
-        activities = activity_plan.get("activities", [])
+        activities = aligned_activities
         if activities:
             execution_log = ""
             if RUN_EVENTS and action_chain is not None:
@@ -539,6 +622,8 @@ def run_multi_day_simulation() -> None:
 
         print(f"[OK] Day {day_index} completed.")
 
+    _flush_writes()
+
 
 if __name__ == "__main__":
     run_multi_day_simulation()
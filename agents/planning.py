@@ -1,6 +1,9 @@
+import functools
 import json
 import os
+import re
 import sys
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional
 from typing_extensions import TypedDict
@@ -12,8 +15,7 @@ from pydantic import BaseModel, Field
 from urllib.parse import urlparse
 import socket
 
-load_dotenv()
-
+# 只按固定路径加载项目根目录的 .env；不带参数的 load_dotenv() 会从本文件目录向上搜索到同一个文件，重复解析
 current_dir = Path(__file__).resolve().parent
 dotenv_path = current_dir.parent / ".env"
 load_dotenv(dotenv_path=dotenv_path)
@@ -22,21 +24,37 @@ project_root = current_dir.parent
 if str(project_root) not in sys.path:
     sys.path.insert(0, str(project_root))
 
+from llm_cache import ResultCache, cache_key
 from llm_utils import create_fast_llm
+from json_utils import json_dumps, load_json_file
 from prompt import (
     ACTIVITY_PLANNING_REQUIREMENTS,
+    PLANNING_SYSTEM_PROMPT_TEMPLATE,
     PLANNING_PROMPT_TEMPLATE,
+    PLANNING_SELF_CHECK_INSTRUCTIONS,
     PLANNING_VALIDATION_PROMPT_TEMPLATE,
     PLANNING_CORRECTION_PROMPT_TEMPLATE,
+    PLANNING_DELTA_CORRECTION_PROMPT_TEMPLATE,
     SUMMARIZATION_PROMPT_TEMPLATE,
     VALUES_INTERPRETATION_GUIDE,
+    prerender,
 )
 from agent_config import (
     DEFAULT_MODEL,
     PLANNING_TEMPERATURE,
     PLANNING_USE_RESPONSES_API,
+    PLANNING_CRITIC_MODEL,
+    PLANNING_CRITIC_TEMPERATURE,
+    PLANNING_SEED,
     SKIP_PLANNING_VALIDATION,
     MAX_PLANNING_REVISIONS,
+    PLANNING_DELTA_CORRECTION,
+    PLANNING_GUIDED_JSON,
+    PLANNING_PLAN_CACHE,
+    PLANNING_SELF_CHECK,
+    COMPACT_JSON,
+    PROMPT_JSON_INDENT,
+    LLM_PREFLIGHT,
 )
 
 # ==========================================
@@ -60,7 +78,11 @@ class ActivityPlan(BaseModel):
 
 class ValidationResult(BaseModel):
     is_valid: bool = Field(description="规划是否通过验证")
-    correction_content: Optional[str] = Field(description="如未通过，详细修改建议；通过则为空")
+    correction_content: Optional[str] = Field(description="如未通过，详细修改建议；通过则为 null")
+
+class PlanWithSelfCheck(BaseModel):
+    plan: ActivityPlan
+    self_check: ValidationResult = Field(description="按审核标准对 plan 的自检结论")
 
 class PreviousDaySummary(BaseModel):
     previous_day_summary: str = Field(description="昨日行为总结")
@@ -69,11 +91,30 @@ class PreviousDaySummary(BaseModel):
 # 3. Settings loaders
 # ==========================================
 
+def _mtime_ns(path: Path) -> int:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return 0
+
+
 def load_settings_data(settings_dir_name: str = "settings") -> Dict[str, str]:
     """
     Load settings JSON and format into prompt variables.
+    按文件 mtime 记忆化：文件未改动时直接复用上次的格式化结果，返回副本供调用方修改。
     """
     settings_path = project_root / settings_dir_name
+    return dict(_load_settings_cached(
+        settings_dir_name,
+        _mtime_ns(settings_path / "profile.json"),
+        _mtime_ns(settings_path / "house_layout.json"),
+    ))
+
+
+@functools.lru_cache(maxsize=4)
+def _load_settings_cached(settings_dir_name: str, profile_mtime: int, layout_mtime: int) -> Dict[str, str]:
+    # mtime 只作缓存键，文件被编辑后键变化即重新读盘
+    settings_path = project_root / settings_dir_name
 
     print(f"[INFO] Loading settings from: {settings_path}")
 
@@ -89,8 +130,7 @@ def load_settings_data(settings_dir_name: str = "settings") -> Dict[str, str]:
     profile_path = settings_path / "profile.json"
     if profile_path.exists():
         try:
-            with open(profile_path, "r", encoding="utf-8") as f:
-                profile = json.load(f)
+            profile = load_json_file(profile_path)
 
             name = profile.get("name", "未知")
             age = profile.get("age", "未知")
@@ -110,11 +150,11 @@ def load_settings_data(settings_dir_name: str = "settings") -> Dict[str, str]:
 
             context_data["profile_psychology"] = (
                 "【性格特征 (Personality)】\n"
-                f"{json.dumps(personality, ensure_ascii=False, indent=2)}\n"
+                f"{json_dumps(personality, indent=PROMPT_JSON_INDENT)}\n"
                 "【核心价值观 (Values)】\n"
-                f"{json.dumps(values, ensure_ascii=False, indent=2)}\n"
+                f"{json_dumps(values, indent=PROMPT_JSON_INDENT)}\n"
                 "【兴趣与偏好 (Preferences)】\n"
-                f"{json.dumps(preferences, ensure_ascii=False, indent=2)}\n"
+                f"{json_dumps(preferences, indent=PROMPT_JSON_INDENT)}\n"
             )
 
             routines = profile.get("routines", {})
@@ -122,9 +162,9 @@ def load_settings_data(settings_dir_name: str = "settings") -> Dict[str, str]:
 
             context_data["profile_routines_and_relations"] = (
                 "【详细作息配置 (Routines)】\n"
-                f"{json.dumps(routines, ensure_ascii=False, indent=2)}\n"
+                f"{json_dumps(routines, indent=PROMPT_JSON_INDENT)}\n"
                 "【社交关系网 (Relationships)】\n"
-                f"{json.dumps(relationships, ensure_ascii=False, indent=2)}\n"
+                f"{json_dumps(relationships, indent=PROMPT_JSON_INDENT)}\n"
             )
 
             print("[OK] Profile loaded successfully.")
@@ -135,9 +175,8 @@ def load_settings_data(settings_dir_name: str = "settings") -> Dict[str, str]:
     layout_path = settings_path / "house_layout.json"
     if layout_path.exists():
         try:
-            with open(layout_path, "r", encoding="utf-8") as f:
-                layout_data = json.load(f)
-            context_data["house_layout_json"] = json.dumps(layout_data, ensure_ascii=False, indent=2)
+            layout_data = load_json_file(layout_path)
+            context_data["house_layout_json"] = json_dumps(layout_data, indent=PROMPT_JSON_INDENT)
             print("[OK] House layout loaded successfully.")
         except Exception as exc:
             print(f"[ERROR] Error loading layout: {exc}")
@@ -175,22 +214,22 @@ def build_settings_data_from_cache(profile_dict: Dict, layout_dict: Dict) -> Dic
         preferences = profile_dict.get("preferences", {})
         context_data["profile_psychology"] = (
             "【性格特征 (Personality)】\n"
-            f"{json.dumps(personality, ensure_ascii=False, indent=2)}\n"
+            f"{json_dumps(personality, indent=PROMPT_JSON_INDENT)}\n"
             "【核心价值观 (Values)】\n"
-            f"{json.dumps(values, ensure_ascii=False, indent=2)}\n"
+            f"{json_dumps(values, indent=PROMPT_JSON_INDENT)}\n"
             "【兴趣与偏好 (Preferences)】\n"
-            f"{json.dumps(preferences, ensure_ascii=False, indent=2)}\n"
+            f"{json_dumps(preferences, indent=PROMPT_JSON_INDENT)}\n"
         )
         routines = profile_dict.get("routines", {})
         relationships = profile_dict.get("relationships", [])
         context_data["profile_routines_and_relations"] = (
             "【详细作息配置 (Routines)】\n"
-            f"{json.dumps(routines, ensure_ascii=False, indent=2)}\n"
+            f"{json_dumps(routines, indent=PROMPT_JSON_INDENT)}\n"
             "【社交关系网 (Relationships)】\n"
-            f"{json.dumps(relationships, ensure_ascii=False, indent=2)}\n"
+            f"{json_dumps(relationships, indent=PROMPT_JSON_INDENT)}\n"
         )
     if layout_dict:
-        context_data["house_layout_json"] = json.dumps(layout_dict, ensure_ascii=False, indent=2)
+        context_data["house_layout_json"] = json_dumps(layout_dict, indent=PROMPT_JSON_INDENT)
     return context_data
 
 
@@ -198,8 +237,13 @@ def load_profile_json() -> str:
     profile_path = project_root / "settings" / "profile.json"
     if not profile_path.exists():
         return "{}"
-    with open(profile_path, "r", encoding="utf-8") as f:
-        return json.dumps(json.load(f), ensure_ascii=False, indent=2)
+    return _load_profile_json_cached(str(profile_path), _mtime_ns(profile_path))
+
+
+@functools.lru_cache(maxsize=4)
+def _load_profile_json_cached(profile_path: str, profile_mtime: int) -> str:
+    # 与 _load_settings_cached 相同：mtime 只作缓存键，返回值是不可变字符串，可直接共享
+    return json_dumps(load_json_file(Path(profile_path)), indent=PROMPT_JSON_INDENT)
 
 # ==========================================
 # 4. Graph state
@@ -208,6 +252,7 @@ def load_profile_json() -> str:
 class AgentState(TypedDict):
     inputs: Dict[str, str]
     current_plan: Optional[ActivityPlan]
+    current_plan_json: str  # current_plan 序列化结果，每个规划版本算一次，validate/correct 共用
     validation_result: Optional[ValidationResult]
     revision_count: int
 
@@ -216,11 +261,69 @@ class AgentState(TypedDict):
 # ==========================================
 
 # 极速 LLM，use_responses_api=False 以兼容 with_structured_output
-llm = create_fast_llm(
-    model=DEFAULT_MODEL,
-    temperature=PLANNING_TEMPERATURE,
-    use_responses_api=PLANNING_USE_RESPONSES_API,
+def _planning_llm(model: str, temperature: float, **kwargs):
+    if PLANNING_SEED is not None:
+        kwargs["seed"] = PLANNING_SEED
+    return create_fast_llm(
+        model=model,
+        temperature=temperature,
+        use_responses_api=PLANNING_USE_RESPONSES_API,
+        **kwargs,
+    )
+
+
+# 生成与昨日总结用 llm（保留采样多样性）；审核与修正用 critic_llm（默认温度 0，规则核对要确定性）
+# 审核模型按 PLANNING_CRITIC_MODEL 原名调用（pin_model），不被 OPENAI_MODEL 覆盖；未单独配置时它本就等于 DEFAULT_MODEL
+llm = _planning_llm(DEFAULT_MODEL, PLANNING_TEMPERATURE)
+critic_llm = _planning_llm(PLANNING_CRITIC_MODEL, PLANNING_CRITIC_TEMPERATURE, pin_model=True)
+
+# 提示词模板解析与结构化输出管线在导入时构建一次，各节点调用时复用
+# 规划要求与价值观解读是 prompt.py 常量，预先写入共享 system 消息；档案/布局随仿真不变，同在 system 中形成稳定前缀，
+# 各节点的 human 消息只含指令与 simulation_context/规划数据
+_SYSTEM_TEMPLATE = prerender(
+    PLANNING_SYSTEM_PROMPT_TEMPLATE,
+    activity_planning_requirements=ACTIVITY_PLANNING_REQUIREMENTS,
+    values_interpretation_guide=VALUES_INTERPRETATION_GUIDE,
 )
+_SUMMARY_TEMPLATE = prerender(SUMMARIZATION_PROMPT_TEMPLATE, values_interpretation_guide=VALUES_INTERPRETATION_GUIDE)
+
+def _structured_llm(schema, critic: bool = False):
+    """json_schema + strict 结构化输出；开启 PLANNING_GUIDED_JSON 时另建一个带 guided_json 的实例（共享连接池）。"""
+    target = critic_llm if critic else llm
+    if PLANNING_GUIDED_JSON:
+        model, temperature = (
+            (PLANNING_CRITIC_MODEL, PLANNING_CRITIC_TEMPERATURE) if critic else (DEFAULT_MODEL, PLANNING_TEMPERATURE)
+        )
+        target = _planning_llm(
+            model, temperature, pin_model=critic, extra_body={"guided_json": schema.model_json_schema()}
+        )
+    return target.with_structured_output(schema, method="json_schema", strict=True)
+
+
+def _planning_prompt(human_template: str) -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([("system", _SYSTEM_TEMPLATE), ("human", human_template)])
+
+
+def _shared_prompt_vars(inputs: Dict[str, str]) -> Dict[str, str]:
+    """共享 system 消息与 simulation_context 的变量，各节点在此基础上补充自己的规划数据。"""
+    return {
+        "profile_demographics": inputs["profile_demographics"],
+        "profile_psychology": inputs["profile_psychology"],
+        "profile_routines_and_relations": inputs["profile_routines_and_relations"],
+        "house_layout_json": inputs["house_layout_json"],
+        "simulation_context": inputs.get("simulation_context", "N/A"),
+    }
+
+
+_CRITIC_PLAN_LLM = _structured_llm(ActivityPlan, critic=True)
+_GENERATE_CHAIN = _planning_prompt(PLANNING_PROMPT_TEMPLATE) | _structured_llm(ActivityPlan)
+_GENERATE_SELF_CHECK_CHAIN = _planning_prompt(PLANNING_PROMPT_TEMPLATE + PLANNING_SELF_CHECK_INSTRUCTIONS) | _structured_llm(
+    PlanWithSelfCheck
+)
+_VALIDATE_CHAIN = _planning_prompt(PLANNING_VALIDATION_PROMPT_TEMPLATE) | _structured_llm(ValidationResult, critic=True)
+_CORRECT_CHAIN = _planning_prompt(PLANNING_CORRECTION_PROMPT_TEMPLATE) | _CRITIC_PLAN_LLM
+_CORRECT_DELTA_CHAIN = _planning_prompt(PLANNING_DELTA_CORRECTION_PROMPT_TEMPLATE) | _CRITIC_PLAN_LLM
+_SUMMARY_CHAIN = ChatPromptTemplate.from_template(_SUMMARY_TEMPLATE) | _structured_llm(PreviousDaySummary)
 
 def _estimate_prompt_chars(template: str, variables: Dict[str, str]) -> int:
     total = len(template or "")
@@ -228,68 +331,63 @@ def _estimate_prompt_chars(template: str, variables: Dict[str, str]) -> int:
         total += len(str(val))
     return total
 
+def _use_self_check() -> bool:
+    return PLANNING_SELF_CHECK and not SKIP_PLANNING_VALIDATION and MAX_PLANNING_REVISIONS > 0
+
+
 def generate_node(state: AgentState):
     print("\n[Step 1] Generating Initial Plan...")
-    prompt = ChatPromptTemplate.from_template(PLANNING_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(ActivityPlan, method="json_schema", strict=True)
-    chain = prompt | structured_llm
+    if _use_self_check():
+        return _generate_with_self_check(state)
+    chain = _GENERATE_CHAIN
 
-    result = chain.invoke({
-        "activity_planning_requirements": ACTIVITY_PLANNING_REQUIREMENTS,
-        "values_interpretation_guide": VALUES_INTERPRETATION_GUIDE,
-        **state["inputs"],
-    })
+    vars_for_count = _shared_prompt_vars(state["inputs"])
+    result = chain.invoke(vars_for_count)
     try:
-        vars_for_count = {"activity_planning_requirements": ACTIVITY_PLANNING_REQUIREMENTS, "values_interpretation_guide": VALUES_INTERPRETATION_GUIDE, **state["inputs"]}
-        chars = _estimate_prompt_chars(PLANNING_PROMPT_TEMPLATE, vars_for_count)
+        chars = _estimate_prompt_chars(_SYSTEM_TEMPLATE + PLANNING_PROMPT_TEMPLATE, vars_for_count)
         print(f"[INFO] LLM input size (planning generate): ~{chars} chars (~{chars//4} tokens)")
     except Exception:
         pass
-    return {"current_plan": result, "revision_count": 0}
+    return {"current_plan": result, "current_plan_json": result.model_dump_json(), "revision_count": 0}
 
 
-def validate_node(state: AgentState):
-    if SKIP_PLANNING_VALIDATION:
-        print("\n[FAST] Skipping planning validation (SKIP_PLANNING_VALIDATION=1).")
-        return {"validation_result": ValidationResult(is_valid=True, correction_content=None)}
-    print("\n[Step 2] Validating Plan...")
-    prompt = ChatPromptTemplate.from_template(PLANNING_VALIDATION_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(ValidationResult, method="json_schema", strict=True)
-    chain = prompt | structured_llm
-
+def _generate_with_self_check(state: AgentState):
+    """生成与自检合并为一次调用；本地硬校验优先于模型自检，结论直接作为 validation_result 交给 router。"""
     inputs = state["inputs"]
-    plan_json = state["current_plan"].model_dump_json()
+    output = _GENERATE_SELF_CHECK_CHAIN.invoke(_shared_prompt_vars(inputs))
+    result = output.plan
+    verdict = output.self_check
+    hard_msg = _plan_hard_errors(result.activities, inputs)
+    if hard_msg:
+        verdict = ValidationResult(is_valid=False, correction_content=hard_msg)
+    if verdict.is_valid:
+        print("[OK] Self-check Passed, separate validation skipped.")
+    else:
+        print(f"[ERROR] Self-check Failed. Reason: {(verdict.correction_content or '')[:150]}...")
+    return {
+        "current_plan": result,
+        "current_plan_json": result.model_dump_json(),
+        "validation_result": verdict,
+        "revision_count": 0,
+    }
 
-    result = chain.invoke({
-        "activity_planning_requirements": ACTIVITY_PLANNING_REQUIREMENTS,
-        "profile_psychology": inputs["profile_psychology"],
-        "profile_routines_and_relations": inputs["profile_routines_and_relations"],
-        "house_layout_json": inputs["house_layout_json"],
-        "activity_plans_json": plan_json,
-        "simulation_context": inputs.get("simulation_context", "N/A"),
-    })
-    try:
-        vars_for_count = {
-            "activity_planning_requirements": ACTIVITY_PLANNING_REQUIREMENTS,
-            "profile_psychology": inputs["profile_psychology"],
-            "profile_routines_and_relations": inputs["profile_routines_and_relations"],
-            "house_layout_json": inputs["house_layout_json"],
-            "activity_plans_json": plan_json,
-            "simulation_context": inputs.get("simulation_context", "N/A"),
-        }
-        chars = _estimate_prompt_chars(PLANNING_VALIDATION_PROMPT_TEMPLATE, vars_for_count)
-        print(f"[INFO] LLM input size (planning validate): ~{chars} chars (~{chars//4} tokens)")
-    except Exception:
-        pass
 
-    if result.is_valid:
-        print("[OK] Validation Passed!")
-    else:
-        print(f"[ERROR] Validation Failed. Reason: {result.correction_content[:150]}...")
+@functools.lru_cache(maxsize=4)
+def _layout_room_ids(house_layout_json: str) -> frozenset:
+    # 布局字符串在一次仿真内不变，每轮校验只解析一次
+    return frozenset(json.loads(house_layout_json or "{}").keys())
+
+
+def _plan_hard_errors(activities: List[ActivityItem], inputs: Dict[str, str]) -> Optional[str]:
+    """
+    时间连续性与房间合法性的硬校验；有问题时返回修正说明，否则 None。
+    说明中点名具体 activity_id 与时间点，修正轮（含增量修正）可直接定位。
+    作息/三餐允许带解释的偏差，属语义判断，仍交给 LLM 审核。
+    """
+    messages = []
 
     # Hard check: time continuity (highest priority).
     try:
-        activities = state["current_plan"].activities if state.get("current_plan") else []
         sim_ctx = json.loads(inputs.get("simulation_context", "{}"))
         day_start_time = sim_ctx.get("day_start_time")
         day_end_time = sim_ctx.get("day_end_time")
@@ -297,89 +395,157 @@ def validate_node(state: AgentState):
         if not activities:
             hard_errors.append("日程为空，无法覆盖时间窗口。")
         else:
-            # ensure sorted by start_time
-            def _parse_iso(ts: str):
-                from datetime import datetime
-                return datetime.fromisoformat(ts)
             ordered = sorted(activities, key=lambda a: a.start_time)
             if day_start_time and ordered[0].start_time > day_start_time:
-                hard_errors.append("首个活动开始时间晚于 day_start_time。")
+                hard_errors.append(
+                    f"首个活动 {ordered[0].activity_id} 开始时间 {ordered[0].start_time} 晚于 day_start_time {day_start_time}。"
+                )
             for prev, cur in zip(ordered, ordered[1:]):
                 if cur.start_time > prev.end_time:
-                    hard_errors.append("存在时间空档。")
+                    hard_errors.append(
+                        f"{prev.activity_id} 与 {cur.activity_id} 之间存在时间空档（{prev.end_time} → {cur.start_time}）。"
+                    )
                 if cur.start_time < prev.end_time:
-                    hard_errors.append("存在时间重叠。")
+                    hard_errors.append(
+                        f"{prev.activity_id} 与 {cur.activity_id} 存在时间重叠（{cur.start_time} < {prev.end_time}）。"
+                    )
             if day_end_time and ordered[-1].end_time < day_end_time:
-                hard_errors.append("最后活动未覆盖到 day_end_time。")
+                hard_errors.append(
+                    f"最后活动 {ordered[-1].activity_id} 结束于 {ordered[-1].end_time}，未覆盖到 day_end_time {day_end_time}。"
+                )
         if hard_errors:
-            result.is_valid = False
-            hard_msg = "硬校验失败（时间连续性）： " + " ".join(hard_errors)
-            if result.correction_content:
-                result.correction_content = f"{hard_msg} {result.correction_content}"
-            else:
-                result.correction_content = hard_msg
+            messages.append("硬校验失败（时间连续性）： " + " ".join(hard_errors))
     except Exception:
         pass
 
     # Hard check: main_rooms must exist in house_layout (no hallucinated rooms).
     try:
-        layout = json.loads(inputs.get("house_layout_json", "{}"))
-        valid_rooms = set(layout.keys())
-        activities = state["current_plan"].activities if state.get("current_plan") else []
-        bad_rooms = []
+        valid_rooms = _layout_room_ids(inputs.get("house_layout_json", "{}"))
+        bad_rooms = {}
         for act in activities:
             for room in (act.main_rooms or []):
                 if room not in valid_rooms:
-                    bad_rooms.append(room)
+                    bad_rooms.setdefault(room, []).append(act.activity_id)
         if bad_rooms:
-            result.is_valid = False
-            rooms = ", ".join(sorted(set(bad_rooms)))
-            hard_msg = f"硬校验失败：出现不在 house_layout 中的房间：{rooms}。"
-            if result.correction_content:
-                result.correction_content = f"{hard_msg} {result.correction_content}"
-            else:
-                result.correction_content = hard_msg
+            rooms = ", ".join(f"{room}（{'/'.join(ids)}）" for room, ids in sorted(bad_rooms.items()))
+            messages.append(f"硬校验失败：出现不在 house_layout 中的房间：{rooms}。")
     except Exception:
         pass
 
+    # 与原先逐条前插到 correction_content 的顺序一致：房间问题在前
+    return " ".join(reversed(messages)) if messages else None
+
+
+def validate_node(state: AgentState):
+    if SKIP_PLANNING_VALIDATION:
+        print("\n[FAST] Skipping planning validation (SKIP_PLANNING_VALIDATION=1).")
+        return {"validation_result": ValidationResult(is_valid=True, correction_content=None)}
+    print("\n[Step 2] Validating Plan...")
+    inputs = state["inputs"]
+
+    # 先跑本地硬校验：未通过时直接要求修正，省掉这一轮的 LLM 语义审核
+    activities = state["current_plan"].activities if state.get("current_plan") else []
+    hard_msg = _plan_hard_errors(activities, inputs)
+    if hard_msg:
+        print(f"[ERROR] Validation Failed (hard checks, LLM review skipped). Reason: {hard_msg[:150]}...")
+        return {"validation_result": ValidationResult(is_valid=False, correction_content=hard_msg)}
+
+    chain = _VALIDATE_CHAIN
+    plan_json = state.get("current_plan_json") or state["current_plan"].model_dump_json()
+
+    vars_for_count = {**_shared_prompt_vars(inputs), "activity_plans_json": plan_json}
+    result = chain.invoke(vars_for_count)
+    try:
+        chars = _estimate_prompt_chars(_SYSTEM_TEMPLATE + PLANNING_VALIDATION_PROMPT_TEMPLATE, vars_for_count)
+        print(f"[INFO] LLM input size (planning validate): ~{chars} chars (~{chars//4} tokens)")
+    except Exception:
+        pass
+
+    if result.is_valid:
+        print("[OK] Validation Passed!")
+    else:
+        print(f"[ERROR] Validation Failed. Reason: {(result.correction_content or '')[:150]}...")
+
     return {"validation_result": result}
 
 
+_ACT_ID_RE = re.compile(r"act_\d+")
+
+
+def _delta_correction_span(activities: List[ActivityItem], correction_content: str) -> Optional[range]:
+    """反馈点名的 activity_id 连同前后相邻各 1 个活动构成的下标区间；未点名或覆盖整份计划时返回 None。"""
+    named = set(_ACT_ID_RE.findall(correction_content or ""))
+    hit = [i for i, act in enumerate(activities) if act.activity_id in named]
+    if not hit:
+        return None
+    lo, hi = max(0, hit[0] - 1), min(len(activities), hit[-1] + 2)
+    if hi - lo >= len(activities):
+        return None
+    return range(lo, hi)
+
+
+def _correct_delta(state: AgentState) -> Optional[ActivityPlan]:
+    """只重写被点名的片段并按 activity_id 合并回原计划；片段无法安全合并时返回 None，由调用方整份修正。"""
+    activities = sorted(state["current_plan"].activities, key=lambda a: a.start_time)
+    correction_content = state["validation_result"].correction_content
+    span = _delta_correction_span(activities, correction_content)
+    if span is None:
+        return None
+
+    segment = activities[span.start:span.stop]
+    inputs = state["inputs"]
+    result = _CORRECT_DELTA_CHAIN.invoke({
+        **_shared_prompt_vars(inputs),
+        "affected_activities_json": ActivityPlan(activities=segment).model_dump_json(),
+        "correction_content": correction_content,
+    })
+    # 片段外的活动不许改动；片段越界或边界对不上时放弃增量结果
+    replaced = sorted(result.activities, key=lambda a: a.start_time)
+    segment_ids = {act.activity_id for act in segment}
+    if (
+        not replaced
+        or any(act.activity_id not in segment_ids for act in replaced)
+        or replaced[0].start_time != segment[0].start_time
+        or replaced[-1].end_time != segment[-1].end_time
+    ):
+        print("[WARN] Delta correction out of bounds, falling back to full correction.")
+        return None
+
+    print(f"[INFO] Delta correction: rewrote {len(segment)} of {len(activities)} activities.")
+    return ActivityPlan(activities=activities[:span.start] + replaced + activities[span.stop:])
+
+
 def correct_node(state: AgentState):
     print(f"\n[Step 3] Refining Plan (Attempt {state['revision_count'] + 1})...")
-    prompt = ChatPromptTemplate.from_template(PLANNING_CORRECTION_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(ActivityPlan, method="json_schema", strict=True)
-    chain = prompt | structured_llm
+    if PLANNING_DELTA_CORRECTION:
+        result = _correct_delta(state)
+        if result is not None:
+            return {
+                "current_plan": result,
+                "current_plan_json": result.model_dump_json(),
+                "revision_count": state["revision_count"] + 1,
+            }
+
+    chain = _CORRECT_CHAIN
 
     inputs = state["inputs"]
-    plan_json = state["current_plan"].model_dump_json()
+    plan_json = state.get("current_plan_json") or state["current_plan"].model_dump_json()
 
-    result = chain.invoke({
-        "activity_planning_requirements": ACTIVITY_PLANNING_REQUIREMENTS,
-        "profile_psychology": inputs["profile_psychology"],
-        "profile_routines_and_relations": inputs["profile_routines_and_relations"],
-        "house_layout_json": inputs["house_layout_json"],
-        "simulation_context": inputs.get("simulation_context", "N/A"),
+    vars_for_count = {
+        **_shared_prompt_vars(inputs),
         "original_activity_plans_json": plan_json,
         "correction_content": state["validation_result"].correction_content,
-    })
+    }
+    result = chain.invoke(vars_for_count)
     try:
-        vars_for_count = {
-            "activity_planning_requirements": ACTIVITY_PLANNING_REQUIREMENTS,
-            "profile_psychology": inputs["profile_psychology"],
-            "profile_routines_and_relations": inputs["profile_routines_and_relations"],
-            "house_layout_json": inputs["house_layout_json"],
-            "simulation_context": inputs.get("simulation_context", "N/A"),
-            "original_activity_plans_json": plan_json,
-            "correction_content": state["validation_result"].correction_content,
-        }
-        chars = _estimate_prompt_chars(PLANNING_CORRECTION_PROMPT_TEMPLATE, vars_for_count)
+        chars = _estimate_prompt_chars(_SYSTEM_TEMPLATE + PLANNING_CORRECTION_PROMPT_TEMPLATE, vars_for_count)
         print(f"[INFO] LLM input size (planning correct): ~{chars} chars (~{chars//4} tokens)")
     except Exception:
         pass
 
     return {
         "current_plan": result,
+        "current_plan_json": result.model_dump_json(),
         "revision_count": state["revision_count"] + 1,
     }
 
@@ -395,15 +561,33 @@ def router(state: AgentState):
         return "end"
     return "correct"
 
+
+def after_generate_router(state: AgentState):
+    # 自检模式下生成节点已给出 validation_result，直接按审核结论路由
+    if state.get("validation_result") is not None:
+        return router(state)
+    return "validate"
+
+
+def after_correct_router(state: AgentState):
+    # 最后一轮修正之后的 LLM 校验结果无论如何都会被丢弃，直接结束；只跑本地硬校验把残留问题记进日志
+    if state["revision_count"] < MAX_PLANNING_REVISIONS:
+        return "validate"
+    hard_msg = _plan_hard_errors(state["current_plan"].activities, state["inputs"])
+    print(f"\n[WARN] Max planning revisions reached, final plan not re-validated. Hard checks: {hard_msg or 'passed'}")
+    return "end"
+
 workflow = StateGraph(AgentState)
 workflow.add_node("generate", generate_node)
 workflow.add_node("validate", validate_node)
 workflow.add_node("correct", correct_node)
 
 workflow.set_entry_point("generate")
-workflow.add_edge("generate", "validate")
+workflow.add_conditional_edges(
+    "generate", after_generate_router, {"end": END, "correct": "correct", "validate": "validate"}
+)
 workflow.add_conditional_edges("validate", router, {"end": END, "correct": "correct"})
-workflow.add_edge("correct", "validate")
+workflow.add_conditional_edges("correct", after_correct_router, {"end": END, "validate": "validate"})
 
 app = workflow.compile()
 
@@ -416,12 +600,86 @@ def _load_simulation_context_from_file() -> Optional[Dict[str, str]]:
     if not context_path.exists():
         return None
     try:
-        with open(context_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return load_json_file(context_path)
     except Exception:
         return None
 
 
+def _custom_llm_endpoint() -> Optional[str]:
+    use_custom_base = os.getenv("OPENAI_USE_BASE_URL", "").strip().lower() in {"1", "true", "yes", "y", "on"}
+    base_url = os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_BASE")
+    return base_url if use_custom_base and base_url else None
+
+
+def _host_port(base_url: str):
+    parsed = urlparse(base_url)
+    return parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80)
+
+
+# 端点连通性探测：首次 run_planning 时在后台线程跑一次，不在关键路径上等 DNS/TCP 握手；
+# 规划失败时再等待结果并打印，用于区分端点不可达与接口报错
+_PREFLIGHT_DONE = threading.Event()
+_PREFLIGHT_MESSAGE = ""
+_PREFLIGHT_STARTED = False
+# 探测的连接超时为 2 秒，失败路径最多等这么久
+_PREFLIGHT_WAIT_SECONDS = 3.0
+
+
+def _run_preflight(host: str, port: int) -> None:
+    global _PREFLIGHT_MESSAGE
+    try:
+        with socket.create_connection((host, port), timeout=2):
+            _PREFLIGHT_MESSAGE = f"[OK] LLM endpoint reachable: {host}:{port}"
+    except Exception as exc:
+        _PREFLIGHT_MESSAGE = f"[ERROR] LLM endpoint unreachable: {host}:{port} ({exc})"
+    finally:
+        _PREFLIGHT_DONE.set()
+
+
+def _start_preflight(host: Optional[str], port: int) -> None:
+    global _PREFLIGHT_STARTED
+    if not LLM_PREFLIGHT or _PREFLIGHT_STARTED or not host:
+        return
+    _PREFLIGHT_STARTED = True
+    threading.Thread(target=_run_preflight, args=(host, port), name="llm-preflight", daemon=True).start()
+
+
+def _report_preflight() -> None:
+    """规划失败时调用：等待探测结果（最多 _PREFLIGHT_WAIT_SECONDS 秒）并打印；未启动探测则不输出。"""
+    if not _PREFLIGHT_STARTED:
+        return
+    if _PREFLIGHT_DONE.wait(timeout=_PREFLIGHT_WAIT_SECONDS):
+        print(_PREFLIGHT_MESSAGE)
+    else:
+        print(f"[WARN] LLM endpoint preflight did not finish within {_PREFLIGHT_WAIT_SECONDS:.0f}s")
+
+
+_plan_cache = ResultCache(project_root / "data" / "planning_plan_cache.sqlite", "planning_plan_cache")
+
+
+def _plan_cache_key(settings_data: Dict[str, str]) -> str:
+    return cache_key(
+        DEFAULT_MODEL,
+        PLANNING_TEMPERATURE,
+        PLANNING_CRITIC_MODEL,
+        PLANNING_CRITIC_TEMPERATURE,
+        PLANNING_SEED,
+        MAX_PLANNING_REVISIONS,
+        # 影响"哪些规划会被判为通过"的开关与审核/修正提示词也入键，改动后不复用弱配置下通过的旧结果
+        _use_self_check(),
+        PLANNING_DELTA_CORRECTION,
+        PLANNING_GUIDED_JSON,
+        SKIP_PLANNING_VALIDATION,
+        _SYSTEM_TEMPLATE,
+        PLANNING_PROMPT_TEMPLATE,
+        PLANNING_SELF_CHECK_INSTRUCTIONS,
+        PLANNING_VALIDATION_PROMPT_TEMPLATE,
+        PLANNING_CORRECTION_PROMPT_TEMPLATE,
+        PLANNING_DELTA_CORRECTION_PROMPT_TEMPLATE,
+        _shared_prompt_vars(settings_data),
+    )
+
+
 def run_planning(
     simulation_context: Optional[Dict[str, str]] = None,
     cached_settings_data: Optional[Dict[str, str]] = None,
@@ -434,21 +692,12 @@ def run_planning(
     if settings_data.get("house_layout_json") == "N/A":
         print("[WARN] 房屋布局数据未加载，可能导致生成失败。请检查 settings/house_layout.json")
 
-    # Preflight: show LLM endpoint and attempt a quick TCP connect if base_url is set
-    use_custom_base = os.getenv("OPENAI_USE_BASE_URL", "").strip().lower() in {"1", "true", "yes", "y", "on"}
-    base_url = os.getenv("OPENAI_BASE_URL") or os.getenv("OPENAI_API_BASE")
+    # Preflight: show LLM endpoint and start the background TCP connect check if base_url is set
+    base_url = _custom_llm_endpoint()
     model_name = os.getenv("OPENAI_MODEL") or "gpt-4o"
-    if use_custom_base and base_url:
-        parsed = urlparse(base_url)
-        host = parsed.hostname
-        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    if base_url:
         print(f"[INFO] LLM base_url: {base_url} | model: {model_name}")
-        if host:
-            try:
-                with socket.create_connection((host, port), timeout=2):
-                    print(f"[OK] LLM endpoint reachable: {host}:{port}")
-            except Exception as exc:
-                print(f"[ERROR] LLM endpoint unreachable: {host}:{port} ({exc})")
+        _start_preflight(*_host_port(base_url))
     else:
         print(f"[INFO] LLM using default OpenAI endpoint. model: {model_name}")
 
@@ -456,7 +705,7 @@ def run_planning(
         simulation_context = _load_simulation_context_from_file()
 
     if simulation_context:
-        settings_data["simulation_context"] = json.dumps(simulation_context, ensure_ascii=False, indent=2)
+        settings_data["simulation_context"] = json_dumps(simulation_context, indent=PROMPT_JSON_INDENT)
 
     if SKIP_PLANNING_VALIDATION:
         print("[FAST] Planning: 1 LLM call (generate only), no validate/correct.\n")
@@ -467,48 +716,59 @@ def run_planning(
         "revision_count": 0,
     }
 
+    plan_key = _plan_cache_key(settings_data) if PLANNING_PLAN_CACHE else None
+    cached_plan = _plan_cache.get(plan_key, ActivityPlan) if plan_key else None
+
     try:
-        final_state = app.invoke(initial_state)
+        if cached_plan is not None:
+            print("[CACHE] Planning: identical profile/layout/context, reusing cached plan (0 LLM calls).")
+            final_state = {"current_plan": cached_plan, "revision_count": 0}
+        else:
+            final_state = app.invoke(initial_state)
+            # 只缓存通过校验的规划；修正轮次用尽仍未通过的结果不复用
+            validation = final_state.get("validation_result")
+            if plan_key and final_state.get("current_plan") and validation is not None and validation.is_valid:
+                _plan_cache.put(plan_key, final_state["current_plan"])
 
         if final_state.get("current_plan"):
+            print(f"[INFO] Planning revisions used: {final_state.get('revision_count', 0)}/{MAX_PLANNING_REVISIONS}")
             data_dict = final_state["current_plan"].model_dump()
-            final_json = json.dumps(data_dict, indent=2, ensure_ascii=False)
-
-            print("\n\n[RESULT] Final Activity Plan Generated:")
-            print(final_json)
 
+            # 完整规划只写盘，不再整份回显到终端（长中文描述在慢终端上比写盘还慢）
             output_file = project_root / "data" / "activity.json"
             output_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(output_file, "w", encoding="utf-8") as f:
-                f.write(final_json)
-            print(f"[OK] Result saved to {output_file}")
+            # 落盘文件统一用标准库 json 编码，内容不随是否装有 orjson 而变
+            output_file.write_text(
+                json.dumps(data_dict, indent=None if COMPACT_JSON else 2, ensure_ascii=False), encoding="utf-8"
+            )
+            print(f"\n[RESULT] {len(data_dict['activities'])} activities written to {output_file}")
             return data_dict
     except Exception as exc:
         print(f"\n[ERROR] Execution Error: {exc}")
         import traceback
         traceback.print_exc()
+    # 规划失败：打印端点探测结果，便于判断是否网络不可达
+    _report_preflight()
     return None
 
 
 def generate_previous_day_summary(profile_json: str, activity_logs: List[Dict], execution_log: str = "") -> str:
-    prompt = ChatPromptTemplate.from_template(SUMMARIZATION_PROMPT_TEMPLATE)
-    structured_llm = llm.with_structured_output(PreviousDaySummary, method="json_schema", strict=True)
-    chain = prompt | structured_llm
+    chain = _SUMMARY_CHAIN
 
     activity_payload = {
         "activity_logs": activity_logs,
         "actual_execution_records": execution_log,
     }
 
+    activity_logs_json = json_dumps(activity_payload, indent=PROMPT_JSON_INDENT)
     result = chain.invoke({
         "profile_json": profile_json,
-        "activity_logs_json": json.dumps(activity_payload, ensure_ascii=False, indent=2),
-        "values_interpretation_guide": VALUES_INTERPRETATION_GUIDE,
+        "activity_logs_json": activity_logs_json,
     })
     try:
         vars_for_count = {
             "profile_json": profile_json,
-            "activity_logs_json": json.dumps(activity_payload, ensure_ascii=False, indent=2),
+            "activity_logs_json": activity_logs_json,
             "values_interpretation_guide": VALUES_INTERPRETATION_GUIDE,
         }
         chars = _estimate_prompt_chars(SUMMARIZATION_PROMPT_TEMPLATE, vars_for_count)
@@ -0,0 +1,36 @@
+"""
+JSON 读取与提示词序列化的公共实现：orjson 为可选依赖，装有时走其 Rust 编解码，否则退回标准库 json。
+落盘文件一律用标准库 json 编码（内容不随是否装有 orjson 而变），不经过这里的 json_dumps。
+"""
+import json
+from pathlib import Path
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_json_file(path: Path) -> Any:
+    """装有 orjson 时按字节整体解析（更快、分配更少），否则退回 json.load。"""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def json_dumps(obj: Any, indent: bool = False) -> str:
+    """
+    提示词变量序列化：紧凑分隔符，或 indent=True 时等同 indent=2 的缩进格式。
+    两条路径对普通数据输出一致；但 NaN/±Infinity 在 orjson 下写为 null、在 json 下写为 NaN/Infinity，
+    大指数浮点的写法也不同（1e20 与 1e+20），这类数据的提示词文本会随环境变化。
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode("utf-8")
+        except TypeError:
+            pass  # 非 str 键等 orjson 不支持的输入
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,58 @@
+"""
+LLM 结构化结果的精确匹配缓存（SQLite，按 SHA-256 键）。
+相同模型/温度/提示词/输入变量的调用直接复用上次的 pydantic 结果，跳过网络往返；读写失败只记警告，不影响调用。
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+_log = logging.getLogger(__name__)
+
+
+def cache_key(*parts: Any) -> str:
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """单表 key -> model_dump_json。线程安全，连接在首次使用时打开。"""
+
+    def __init__(self, path: Path, table: str):
+        self.path = path
+        self.table = table
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        # 调用方需持有 self._lock
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, model_cls):
+        try:
+            with self._lock:
+                row = self._db().execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            return model_cls.model_validate_json(row[0]) if row else None
+        except Exception as e:
+            _log.warning("LLM cache read failed (%s): %s", self.table, e)
+            return None
+
+    def put(self, key: str, result) -> None:
+        try:
+            with self._lock:
+                conn = self._db()
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                    (key, result.model_dump_json()),
+                )
+                conn.commit()
+        except Exception as e:
+            _log.warning("LLM cache write failed (%s): %s", self.table, e)
@@ -2,10 +2,16 @@ import json
 import os
 import time
 import logging
+import threading
 from typing import Optional
 
 from langchain_openai import ChatOpenAI
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 _log = logging.getLogger(__name__)
 
 def _should_log_timing() -> bool:
@@ -164,6 +170,37 @@ def _request_timeout() -> int:
         return int(os.getenv("OPENAI_REQUEST_TIMEOUT", "120") or "120")
 
 
+_shared_http_client = None
+_shared_http_client_lock = threading.Lock()
+
+
+def shared_http_client():
+    """
+    进程内共享的 httpx 连接池（装了 h2 时走 HTTP/2 多路复用），各层 LLM 复用同一批连接，
+    避免每个 ChatOpenAI 实例各自建连与 TLS 握手。httpx 不可用时返回 None，由 SDK 自建客户端。
+    """
+    global _shared_http_client
+    if httpx is None:
+        return None
+    if _shared_http_client is None:
+        with _shared_http_client_lock:
+            if _shared_http_client is None:
+                limits = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+                try:
+                    _shared_http_client = httpx.Client(http2=True, limits=limits)
+                except ImportError:
+                    # 未安装 h2：退回 HTTP/1.1 keep-alive
+                    _shared_http_client = httpx.Client(limits=limits)
+    return _shared_http_client
+
+
+def _with_shared_http_client(kwargs: dict) -> None:
+    if "http_client" not in kwargs:
+        client = shared_http_client()
+        if client is not None:
+            kwargs["http_client"] = client
+
+
 def create_chat_llm(
     model: str,
     temperature: float | None = None,
@@ -180,6 +217,7 @@ def create_chat_llm(
             base_url = "https://api.openai.com/v1"
     kwargs.setdefault("use_responses_api", False)
     kwargs.setdefault("request_timeout", _request_timeout())
+    _with_shared_http_client(kwargs)
     return LenientChatOpenAI(
         model=_resolve_model(model),
         temperature=temperature,
@@ -218,8 +256,10 @@ def create_fast_llm(
     model: str = "gpt-5-nano",
     temperature: float = 0,
     use_responses_api: bool = True,
+    pin_model: bool = False,
     **kwargs,
 ) -> ChatOpenAI:
+    """pin_model=True 时按传入的 model 调用，不被 OPENAI_MODEL 覆盖（用于单独配置的快速/审核模型）。"""
     base_url = kwargs.pop("base_url", None)
     if base_url is None:
         if _use_base_url():
@@ -237,7 +277,7 @@ def create_fast_llm(
     reasoning_effort = kwargs.pop("reasoning_effort", REASONING_EFFORT)
     # verbosity 仅用于 Responses API；Completions API 传 model_kwargs.text 会导致 parse() 报 unexpected 'text'
     model_kwargs = {"text": {"verbosity": VERBOSITY}} if use_responses_api else {}
-    resolved_model = _resolve_model(model)
+    resolved_model = model if pin_model else _resolve_model(model)
     if LLM_DEBUG:
         _log.info(
             "create_fast_llm: model=%s reasoning_effort=%s use_responses_api=%s base_url=%s",
@@ -245,6 +285,7 @@ def create_fast_llm(
             base_url[:50] + "..." if base_url and len(base_url) > 50 else base_url,
         )
     kwargs.setdefault("request_timeout", _request_timeout())
+    _with_shared_http_client(kwargs)
     cls = _TimedChatOpenAI if _should_log_timing() else ChatOpenAI
     return cls(
         model=resolved_model,
@@ -165,7 +165,7 @@ EVENT_VALIDATION_PROMPT_TEMPLATE = """
 10. **作息一致性**：若父活动为睡眠/就寝类，**首条事件的 start_time** 应贴合居民档案中的 sleep_schedule（如 weekend_bedtime）；若开始时间在凌晨 02:00 之后而档案就寝时间为 22:30 等，判不通过（自律人设不得随意熬夜到凌晨）；若在下午或傍晚（如 18:00）开始睡眠而档案就寝为 23:00，或睡眠总时长超过 12 小时（如 18:00→次日 07:00），判不通过（禁止时间轴缩水）。**start_time/end_time** 必须为合法 ISO，不得包含类型标记（如 :string）。
 
 ## 返回结果
-- Pass: is_valid: true
+- Pass: is_valid: true，correction_content 为 null，不要输出任何评语或通过理由。
 - Fail: is_valid: false, 并在 correction_content 中列出"必须修正"的具体点（房间/物品/时间/动作）。注意：通用物理交互（clean/fix/inspect/touch/move_to 等）不得以「未在 support_actions 中」为由判 Fail。
 """
 
@@ -209,20 +209,15 @@ EVENT_CORRECTION_PROMPT_TEMPLATE = """
 
 DEVICE_STATE_GEN_PROMPT = """
 You are a smart-home behavior analyzer.
-Given a user event, infer what device state changes should happen at the start and end.
-
-## Inputs
-- **Event**: {description}
-- **Time**: {start_time} to {end_time}
-- **Devices**: {target_devices}
-- **Reference**: {device_details}
+Given a numbered list of user events (see Inputs at the end), infer what device state changes should happen at the start and end of EACH event.
 
 ## Requirements
+0. **One result per event**: Return exactly one item in `results` for every event listed under Inputs below, and copy its `event_index` from the `[event_index]` label. Events are independent; do not merge or reorder them.
 1. **Patch on Start**: device changes at event start (e.g., power on, set mode).
 2. **Patch on End**: device changes at event end (e.g., power off). If no change needed, return empty.
 3. **Timestamps**:
-   - Start Patch timestamp must equal {start_time}
-   - End Patch timestamp must equal {end_time}
+   - Start Patch timestamp must equal that event's start time
+   - End Patch timestamp must equal that event's end time
 4. **Format**:
    - Provide changes as a list of key/value items (patch_items).
    - Example: {{"key": "power", "value": "on"}}
@@ -234,8 +229,13 @@ Given a user event, infer what device state changes should happen at the start a
 
 8. **Only patch real appliances**: Do not emit power/mode patches for furniture or fixtures (beds, tables, chairs, wardrobes, rugs, mirrors, etc.)—they have no power state. Apply patches only to devices that actually have on/off or adjustable parameters.
 
-## Example Output
-See requirements above; ensure output matches the EventDeviceState schema.
+## Output
+Follow the requirements above and the BatchEventDeviceState schema; the events to analyze are listed under Inputs below.
+
+## Inputs
+Each event is listed as `[event_index]` followed by its description, time window, target devices and device reference.
+
+{events_block}
 """
 
 # =============================================================================
@@ -305,23 +305,17 @@ ACTIVITY_PLANNING_REQUIREMENTS = """
 - `main_rooms`: 涉及的房间ID列表。
 """
 
-PLANNING_PROMPT_TEMPLATE = """
-你是一个基于大模型的高保真人类行为模拟器。请根据以下多维度的居民档案和物理环境，通过逻辑推演，规划出这位居民一天的"起床到入睡"活动流。
+# 四个规划节点（生成/审核/修正/增量修正）共用同一条 system 消息：规划要求、居民档案与房屋布局在一次仿真内不变，
+# 放在最前面作为稳定前缀，供带前缀缓存的服务端在各节点、各轮修正之间复用；human 消息只放各节点的指令与逐次变化的数据
+PLANNING_SYSTEM_PROMPT_TEMPLATE = """
+你是一个基于大模型的高保真人类行为模拟器，负责居民一日活动规划的生成、审核与修正。
+以下价值观解读、规划要求、居民档案与物理环境在本次规划的所有步骤中保持不变，具体任务见后续指令。
 
 {values_interpretation_guide}
 
 {activity_planning_requirements}
 
-## 状态机事件要求（高优先级）
-当 `simulation_state` 为 **Perturbed** 或 **Crisis** 时，按下述规则生成事件：
-1. 读取 `random_event_count` 或 `emergency_event_count`，并**生成对应数量**的异常事件。
-2. **必须**在活动描述中明确标注事件（使用"事件：<内容>"格式）。
-3. 每个事件必须对当天日程产生实际影响（取消/推迟/缩短/改地点等）。
-4. 如果是 Crisis，后续活动应转为应对处理（就医、维修、联系家人等）。
-
-## 输入数据
-
-### 1. 居民档案 (Profile)
+## 居民档案 (Profile)
 **基础信息 (Layer 1):**
 {profile_demographics}
 
@@ -333,35 +327,42 @@ PLANNING_PROMPT_TEMPLATE = """
 *请严格遵守以下作息时间表和社交关系网。*
 {profile_routines_and_relations}
 
-### 2. 物理环境 (Environment)
-**房屋布局与物品清单**
+## 物理环境 (Environment)
+**房屋布局与物品清单 (Asset List)**
 *请注意检查每个房间内的 `furniture` 和 `devices` 列表，确保活动有物可依。*
 {house_layout_json}
+"""
+
+PLANNING_PROMPT_TEMPLATE = """
+请根据上述居民档案和物理环境，通过逻辑推演，规划出这位居民一天的"起床到入睡"活动流。
 
-### 3. 仿真上下文 (Simulation Context)
+## 状态机事件要求（高优先级）
+当 `simulation_state` 为 **Perturbed** 或 **Crisis** 时，按下述规则生成事件：
+1. 读取 `random_event_count` 或 `emergency_event_count`，并**生成对应数量**的异常事件。
+2. **必须**在活动描述中明确标注事件（使用"事件：<内容>"格式）。
+3. 每个事件必须对当天日程产生实际影响（取消/推迟/缩短/改地点等）。
+4. 如果是 Crisis，后续活动应转为应对处理（就医、维修、联系家人等）。
+
+## 仿真上下文 (Simulation Context)
 {simulation_context}
 """
 
+# 生成即自检（SIM_PLANNING_SELF_CHECK=1）时接在 PLANNING_PROMPT_TEMPLATE 之后，让模型在同一次调用里给出规划与审核结论
+PLANNING_SELF_CHECK_INSTRUCTIONS = """
+## 生成后自检（与规划一并输出）
+完成规划后，请以"行为逻辑审核员"的标准逐项复查你的规划，并把结论写入 `self_check`：
+1. 时间连续、无空档无重叠，覆盖 `day_start_time` 至 `day_end_time`，首个活动为起床、最后一个为入睡。
+2. 起床/入睡/三餐贴合 Profile（±30 分钟），超出时描述中已说明原因；固定事项出现在正确时间段。
+3. main_rooms 均来自 house_layout，活动只使用 Asset List 中的物品。
+4. Perturbed/Crisis 状态下异常事件及其影响已体现；安排与 `agent_state`、性格价值观一致。
+- 全部满足: `self_check.is_valid = true`，`correction_content` 为 null。
+- 任一不满足: `self_check.is_valid = false`，在 `correction_content` 中点名 activity_id 并说明必须修正之处；`plan` 仍输出当前版本。
+"""
+
 PLANNING_VALIDATION_PROMPT_TEMPLATE = """
 请作为"行为逻辑审核员"，审核以下AI生成的居民活动规划。
 你的任务是确保规划不仅在时间上连续，而且在**性格逻辑**和**物理环境**上是真实的。
 
-{activity_planning_requirements}
-
-## 待审核数据
-**居民性格与习惯**
-{profile_psychology}
-{profile_routines_and_relations}
-
-**房屋物品清单:**
-{house_layout_json}
-
-**当前活动规划:**
-{activity_plans_json}
-
-**仿真上下文 (含 agent_state):**
-{simulation_context}
-
 ## 验证维度
 1. **时间连续性 (强校验)**: 不允许时间重叠或空档，必须覆盖 `day_start_time` 至 `day_end_time`。
 2. **起始时间 (强校验)**:
@@ -387,24 +388,36 @@ PLANNING_VALIDATION_PROMPT_TEMPLATE = """
 10. **性格逻辑性**: 活动是否违背 Big Five 性格与价值观。
 
 ## 返回结果
-- 如通过: is_valid = true, correction_content 为空。
+- 如通过: 仅返回 is_valid = true，correction_content 为 null，不要输出任何评语或通过理由。
 - 如不通过: is_valid = false，并在 correction_content 中详细说明"必须修正"的冲突点（含异常事件是否体现）。
+
+## 待审核数据
+**仿真上下文 (含 agent_state):**
+{simulation_context}
+
+**当前活动规划:**
+{activity_plans_json}
 """
 
 PLANNING_CORRECTION_PROMPT_TEMPLATE = """
 你是一个专业的生活规划师。上一轮生成的规划未能通过逻辑验证。
 请根据验证反馈，重新生成修正后的活动规划。
 
-{activity_planning_requirements}
+## 修正指令
+1. 优先解决反馈中指出的逻辑冲突。
+2. **时间修正 (强制)**：补齐空档并消除重叠，保证覆盖 `day_start_time` 至 `day_end_time`。
+3. **起始时间 (强制)**：若 `day_start_time` 不是 00:00，活动必须从 `day_start_time` 开始。
+4. **起床/入睡边界 (强制)**：第一个活动必须是"起床/醒来"，最后一个活动必须是"入睡/睡眠"，并覆盖到 `day_end_time`。
+5. **作息/餐点 (强制)**：严格贴合 Profile 的作息与三餐时间窗口；若有偏差必须在描述中解释原因。
+6. **固定事项 (强制)**：Profile 中明确的固定安排必须出现在正确日期/时间段；如被扰动/危机取消，需明确说明原因与替代安排。
+7. **房间合法性 (强制)**：main_rooms 必须来自 house_layout；外出活动 main_rooms 为空。
+8. **物品可用性 (强制)**：活动描述需明确使用该房间内的家具/设备。
+9. **资产清单强制**：只能与 Asset List 中的物品交互，禁止臆造物品。
+10. **房间映射强制**：禁止使用不在 house_layout 中的房间；如出现，必须改为有效房间。
+11. **扰动/危机体现 (强制)**：当 `simulation_state` 为 Perturbed/Crisis 时，必须在当天活动描述中体现异常事件及其对日程的影响。
+12. **实时状态一致性 (强制)**：`agent_state` 若显示疲劳/不适/情绪低落，应调整强度与节奏，并在描述中体现恢复/缓解措施。
 
 ## 参考数据
-**居民性格与习惯**
-{profile_psychology}
-{profile_routines_and_relations}
-
-**房屋物品清单:**
-{house_layout_json}
-
 **仿真上下文 (含 agent_state):**
 {simulation_context}
 
@@ -414,20 +427,30 @@ PLANNING_CORRECTION_PROMPT_TEMPLATE = """
 
 **验证未通过原因 (必读):**
 {correction_content}
+"""
+
+PLANNING_DELTA_CORRECTION_PROMPT_TEMPLATE = """
+你是一个专业的生活规划师。上一轮生成的规划未能通过逻辑验证，验证反馈点名了部分活动。
+请只修正下方给出的活动片段（被点名的活动及其前后相邻活动），其余活动保持不变、由程序合并。
 
 ## 修正指令
 1. 优先解决反馈中指出的逻辑冲突。
-2. **时间修正 (强制)**：补齐空档并消除重叠，保证覆盖 `day_start_time` 至 `day_end_time`。
-3. **起始时间 (强制)**：若 `day_start_time` 不是 00:00，活动必须从 `day_start_time` 开始。
-4. **起床/入睡边界 (强制)**：第一个活动必须是"起床/醒来"，最后一个活动必须是"入睡/睡眠"，并覆盖到 `day_end_time`。
-5. **作息/餐点 (强制)**：严格贴合 Profile 的作息与三餐时间窗口；若有偏差必须在描述中解释原因。
-6. **固定事项 (强制)**：Profile 中明确的固定安排必须出现在正确日期/时间段；如被扰动/危机取消，需明确说明原因与替代安排。
-7. **房间合法性 (强制)**：main_rooms 必须来自 house_layout；外出活动 main_rooms 为空。
-8. **物品可用性 (强制)**：活动描述需明确使用该房间内的家具/设备。
-9. **资产清单强制**：只能与 Asset List 中的物品交互，禁止臆造物品。
-10. **房间映射强制**：禁止使用不在 house_layout 中的房间；如出现，必须改为有效房间。
-11. **扰动/危机体现 (强制)**：当 `simulation_state` 为 Perturbed/Crisis 时，必须在当天活动描述中体现异常事件及其对日程的影响。
-12. **实时状态一致性 (强制)**：`agent_state` 若显示疲劳/不适/情绪低落，应调整强度与节奏，并在描述中体现恢复/缓解措施。
+2. **只返回片段内的活动**：保留原 activity_id；不得返回片段以外的活动。
+3. **边界衔接 (强制)**：片段首个活动的 start_time 与最后一个活动的 end_time 必须与原片段一致，片段内部无空档、无重叠。
+4. **房间合法性 (强制)**：main_rooms 必须来自 house_layout；外出活动 main_rooms 为空。
+5. **资产清单强制**：只能与 Asset List 中的物品交互，禁止臆造物品。
+6. **实时状态一致性 (强制)**：`agent_state` 若显示疲劳/不适/情绪低落，应调整强度与节奏。
+
+## 参考数据
+**仿真上下文 (含 agent_state):**
+{simulation_context}
+
+## 待修正片段与问题
+**待修正活动片段:**
+{affected_activities_json}
+
+**验证未通过原因 (必读):**
+{correction_content}
 """
 
 SUMMARIZATION_PROMPT_TEMPLATE = """
@@ -855,3 +878,14 @@ LAYOUT2DETAILS_SINGLE_ITEM_PROMPT_TEMPLATE = """
 - **设备**的 support_actions 不得为空且仅含设备相关动作；**家具**的 support_actions 可填 []，程序会统一覆盖。
 - 严格按照 JSON Schema 输出 items 列表（单元素）。
 """
+
+
+# =============================================================================
+# 模板工具
+# =============================================================================
+
+def prerender(template: str, **constants: str) -> str:
+    """把导入期即确定的常量直接写入模板（花括号转义为字面量），调用时只剩逐次变化的槽位。"""
+    for name, value in constants.items():
+        template = template.replace("{" + name + "}", value.replace("{", "{{").replace("}", "}}"))
+    return template
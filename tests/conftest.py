@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+# agents/ 下的模块以脚本方式运行（python agents/n_day_simulation.py），互相按顶层名导入，测试同样把该目录放进 sys.path
+AGENTS_DIR = Path(__file__).resolve().parents[1] / "agents"
+if str(AGENTS_DIR) not in sys.path:
+    sys.path.insert(0, str(AGENTS_DIR))
+
+# 各层在导入时就构建 LLM 客户端；测试不发请求，给一个占位密钥即可
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+import n_day_simulation as nds
+
+
+def test_flush_reraises_first_write_failure_once(tmp_path):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("not a directory", encoding="utf-8")
+
+    nds._write_json(tmp_path / "ok.json", {"a": 1})
+    nds._write_json(blocker / "bad.json", {"a": 1})
+    with pytest.raises(OSError):
+        nds._flush_writes()
+
+    # 失败的写入不影响同批其他文件；异常只抛一次
+    assert json.loads((tmp_path / "ok.json").read_text(encoding="utf-8")) == {"a": 1}
+    nds._flush_writes()
+
+
+def test_write_json_writes_snapshot_to_every_path(tmp_path):
+    payload = {"n": 1}
+    nds._write_json(tmp_path / "latest.json", payload, tmp_path / "day1.json")
+    payload["n"] = 2
+    nds._flush_writes()
+    for name in ("latest.json", "day1.json"):
+        assert json.loads((tmp_path / name).read_text(encoding="utf-8")) == {"n": 1}
+
+
+def test_copy_json_runs_after_queued_write(tmp_path):
+    src = tmp_path / "src.json"
+    nds._write_json(src, {"x": 1})
+    nds._copy_json(src, tmp_path / "archive" / "src_day1.json")
+    nds._flush_writes()
+    assert json.loads((tmp_path / "archive" / "src_day1.json").read_text(encoding="utf-8")) == {"x": 1}
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from event import EventItem, _fit_event_times, _local_event_problems
+
+LAYOUT = {"living_room": {"furniture": ["sofa"], "devices": []}}
+
+
+def _event(start: str, end: str, room: str = "living_room") -> EventItem:
+    return EventItem(
+        activity_id="act_001",
+        start_time=start,
+        end_time=end,
+        room_id=room,
+        target_object_ids=[],
+        action_type="interact",
+        description="看书",
+    )
+
+
+def _instant(s: str) -> datetime:
+    return datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+def test_fit_fills_parent_window_in_proportion():
+    activity = {"start_time": "2025-01-01T08:00:00", "end_time": "2025-01-01T09:00:00"}
+    events = [
+        _event("2025-01-01T08:00:00", "2025-01-01T08:20:00"),
+        _event("2025-01-01T08:30:00", "2025-01-01T09:10:00"),
+    ]
+    assert _fit_event_times(events, activity)
+    assert [(e.start_time, e.end_time) for e in events] == [
+        ("2025-01-01T08:00:00", "2025-01-01T08:20:00"),
+        ("2025-01-01T08:20:00", "2025-01-01T09:00:00"),
+    ]
+    assert _local_event_problems(events, activity, LAYOUT) == ([], [])
+
+
+def test_fit_writes_mixed_zone_events_in_parent_notation():
+    # 事件混用 Z 与 +08:00：修正后必须统一为父活动的写法，首尾相接的时间指向同一时刻
+    activity = {"start_time": "2025-01-01T08:00:00+08:00", "end_time": "2025-01-01T09:00:00+08:00"}
+    events = [
+        _event("2025-01-01T08:00:00Z", "2025-01-01T08:20:00+08:00"),
+        _event("2025-01-01T08:25:00", "2025-01-01T09:00:00Z"),
+    ]
+    assert _fit_event_times(events, activity)
+    for ev in events:
+        assert ev.start_time.endswith("+08:00") and ev.end_time.endswith("+08:00")
+    assert _instant(events[0].start_time) == _instant(activity["start_time"])
+    assert _instant(events[0].end_time) == _instant(events[1].start_time)
+    assert _instant(events[-1].end_time) == _instant(activity["end_time"])
+
+
+def test_fit_keeps_z_notation_of_parent():
+    activity = {"start_time": "2025-01-01T08:00:00Z", "end_time": "2025-01-01T08:10:00Z"}
+    events = [_event("2025-01-01T08:00:00+08:00", "2025-01-01T08:12:00")]
+    assert _fit_event_times(events, activity)
+    assert (events[0].start_time, events[0].end_time) == ("2025-01-01T08:00:00Z", "2025-01-01T08:10:00Z")
+
+
+def test_fit_rejects_unparseable_or_too_short_window():
+    activity = {"start_time": "2025-01-01T08:00:00", "end_time": "2025-01-01T08:00:01"}
+    events = [_event("2025-01-01T08:00:00", "2025-01-01T08:00:01")] * 2
+    assert not _fit_event_times(events, activity)
+    bad = [_event("2025-01-01T08:00:00", "08:00:string")]
+    assert not _fit_event_times(bad, {"start_time": "2025-01-01T08:00:00", "end_time": "2025-01-01T09:00:00"})
+
+
+def test_local_problems_compare_mixed_zones_without_type_error():
+    activity = {"start_time": "2025-01-01T08:00:00", "end_time": "2025-01-01T09:00:00"}
+    events = [
+        _event("2025-01-01T08:00:00Z", "2025-01-01T08:30:00", room="Living Room"),
+        _event("2025-01-01T08:30:00", "2025-01-01T09:00:00+00:00"),
+    ]
+    problems, time_problems = _local_event_problems(events, activity, LAYOUT)
+    assert problems == []
+    assert time_problems == []
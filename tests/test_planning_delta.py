@@ -0,0 +1,91 @@
+import json
+
+import planning
+from planning import ActivityItem, ActivityPlan, ValidationResult, _correct_delta, _delta_correction_span
+
+INPUTS = {
+    "profile_demographics": "N/A",
+    "profile_psychology": "N/A",
+    "profile_routines_and_relations": "N/A",
+    "house_layout_json": "{}",
+}
+
+
+def _act(n: int, start: str, end: str, name: str = "") -> ActivityItem:
+    return ActivityItem(
+        activity_id=f"act_{n:03d}",
+        activity_name=name or f"活动{n}",
+        start_time=f"2025-01-01T{start}:00",
+        end_time=f"2025-01-01T{end}:00",
+        description="",
+        main_rooms=["living_room"],
+    )
+
+
+PLAN = [
+    _act(1, "07:00", "08:00"),
+    _act(2, "08:00", "09:00"),
+    _act(3, "09:00", "10:00"),
+    _act(4, "10:00", "11:00"),
+    _act(5, "11:00", "12:00"),
+]
+
+
+class _FakeChain:
+    def __init__(self, activities):
+        self.activities = activities
+        self.calls = []
+
+    def invoke(self, variables):
+        self.calls.append(variables)
+        return ActivityPlan(activities=self.activities)
+
+
+def _state(correction: str):
+    return {
+        "inputs": INPUTS,
+        "current_plan": ActivityPlan(activities=list(reversed(PLAN))),
+        "validation_result": ValidationResult(is_valid=False, correction_content=correction),
+    }
+
+
+def test_span_covers_named_activity_and_neighbours():
+    assert _delta_correction_span(PLAN, "act_003 与 act_004 时间重叠") == range(1, 5)
+    assert _delta_correction_span(PLAN, "act_001 起床时间过早") == range(0, 2)
+
+
+def test_span_is_none_when_unnamed_or_whole_plan():
+    assert _delta_correction_span(PLAN, "整体节奏过于紧凑") is None
+    assert _delta_correction_span(PLAN, "act_002 与 act_004 都有问题") is None
+    assert _delta_correction_span(PLAN, None) is None
+
+
+def test_correct_delta_merges_rewritten_segment(monkeypatch):
+    rewritten = [_act(2, "08:00", "08:40"), _act(3, "08:40", "10:00", name="修正后"), _act(4, "10:00", "11:00")]
+    fake = _FakeChain(rewritten)
+    monkeypatch.setattr(planning, "_CORRECT_DELTA_CHAIN", fake)
+
+    result = _correct_delta(_state("act_003 开始时间与上一活动冲突"))
+
+    assert [a.activity_id for a in result.activities] == ["act_001", "act_002", "act_003", "act_004", "act_005"]
+    assert result.activities[2].activity_name == "修正后"
+    assert result.activities[0] == PLAN[0] and result.activities[-1] == PLAN[-1]
+    sent = json.loads(fake.calls[0]["affected_activities_json"])["activities"]
+    assert [a["activity_id"] for a in sent] == ["act_002", "act_003", "act_004"]
+
+
+def test_correct_delta_rejects_out_of_bounds_rewrite(monkeypatch):
+    moved_boundary = [_act(2, "08:30", "09:00"), _act(3, "09:00", "10:00"), _act(4, "10:00", "11:00")]
+    monkeypatch.setattr(planning, "_CORRECT_DELTA_CHAIN", _FakeChain(moved_boundary))
+    assert _correct_delta(_state("act_003 需要调整")) is None
+
+    foreign_id = [_act(2, "08:00", "09:00"), _act(3, "09:00", "10:00"), _act(5, "10:00", "11:00")]
+    monkeypatch.setattr(planning, "_CORRECT_DELTA_CHAIN", _FakeChain(foreign_id))
+    assert _correct_delta(_state("act_003 需要调整")) is None
+
+
+def test_correct_delta_skips_llm_without_named_activity(monkeypatch):
+    fake = _FakeChain(PLAN)
+    monkeypatch.setattr(planning, "_CORRECT_DELTA_CHAIN", fake)
+    assert _correct_delta(_state("整体节奏过于紧凑")) is None
+    assert fake.calls == []